@@ -0,0 +1,280 @@
+"""
+ベンチマーク用の疑似動画ホスト
+プログレッシブMP4・HLS・DASHを合成して配信する（yt-dlpの汎用抽出器でそのまま取得できる）
+サイズ・セグメント数・遅延・帯域・エラーの発生率はURLのクエリで指定する
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+
+# クエリの既定値
+DEFAULT_SIZE = 5 * 1024 * 1024
+DEFAULT_SEGMENTS = 20
+DEFAULT_SEGMENT_SIZE = 256 * 1024
+DEFAULT_SEGMENT_DURATION = 4
+DEFAULT_ERROR_STATUS = 503
+
+# 本文は同じブロックを繰り返して作る（生成のコストを計測に混ぜないように）
+PAYLOAD_BLOCK = os.urandom(64 * 1024)
+# 帯域を絞るときに1回に書き込む量
+WRITE_CHUNK = 16 * 1024
+
+CONTENT_TYPES = {
+    "mp4": "video/mp4",
+    "m3u8": "application/vnd.apple.mpegurl",
+    "mpd": "application/dash+xml",
+    "ts": "video/mp2t",
+    "m4s": "video/iso.segment",
+}
+
+
+def build_m3u8(params, query):
+    """セグメント数×再生時間のメディアプレイリスト"""
+    segments = params["segments"]
+    duration = params["segment_duration"]
+    lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{duration}", "#EXT-X-MEDIA-SEQUENCE:0",
+             "#EXT-X-PLAYLIST-TYPE:VOD"]
+    for index in range(segments):
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(f"{params['name']}/{index}.ts?{query}")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def build_mpd(params, query):
+    """映像1本のSegmentTemplate形式のMPD"""
+    segments = params["segments"]
+    duration = params["segment_duration"]
+    bandwidth = params["segment_size"] * 8 // duration
+    name = params["name"]
+    # SegmentTemplateの$Number$と衝突しないよう、クエリの&はエスケープする
+    query = query.replace("&", "&amp;")
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S"
+     mediaPresentationDuration="PT{segments * duration}S" profiles="urn:mpeg:dash:profile:isoff-live:2011">
+  <Period id="0" start="PT0S">
+    <AdaptationSet mimeType="video/mp4" contentType="video" segmentAlignment="true">
+      <Representation id="video" codecs="avc1.4d401f" width="1280" height="720" frameRate="30" bandwidth="{bandwidth}">
+        <SegmentTemplate timescale="1" duration="{duration}" startNumber="0"
+                         initialization="{name}/init.mp4?{query}" media="{name}/$Number$.m4s?{query}"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def parse_params(name, query):
+    """URLのクエリを配信条件にする"""
+    values = {key: items[-1] for key, items in parse_qs(query).items()}
+    return {
+        "name": name,
+        "size": int(values.get("size", DEFAULT_SIZE)),
+        "segments": int(values.get("segments", DEFAULT_SEGMENTS)),
+        "segment_size": int(values.get("segment_size", DEFAULT_SEGMENT_SIZE)),
+        "segment_duration": int(values.get("segment_duration", DEFAULT_SEGMENT_DURATION)),
+        # 応答を返し始めるまでの遅延（ミリ秒）と、接続ごとの帯域（KB/s、0は無制限）
+        "latency": float(values.get("latency", 0)) / 1000,
+        "rate": float(values.get("rate", 0)) * 1024,
+        # メディアの要求のうちエラーを返す割合（0〜1）と、そのステータス
+        "error_rate": float(values.get("error_rate", 0)),
+        "error_status": int(values.get("error_status", DEFAULT_ERROR_STATUS)),
+    }
+
+
+class FakeHostServer(ThreadingHTTPServer):
+    daemon_threads = True
+    
+    def handle_error(self, request, client_address):
+        # 接続を使い回すクライアントが終了時に切断するのは正常なので、トレースバックを出さない
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+class FakeVideoHost:
+    """疑似動画ホストのHTTPサーバー。要求数・接続数・送信バイト数を数える"""
+    def __init__(self, host="127.0.0.1", port=0):
+        self.httpd = FakeHostServer((host, port), FakeHostHandler)
+        self.httpd.fake_host = self
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.thread = None
+    
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def url(self, kind, name, **params):
+        """kind（mp4 / hls / dash）の動画のURL"""
+        query = urlencode({key: value for key, value in params.items() if value is not None})
+        path = {"mp4": f"/{name}.mp4", "hls": f"/hls/{name}.m3u8", "dash": f"/dash/{name}.mpd"}[kind]
+        return f"{self.base_url}{path}" + (f"?{query}" if query else "")
+    
+    def count(self, **amounts):
+        with self.lock:
+            self.stats.update(amounts)
+    
+    def reset_stats(self):
+        with self.lock:
+            stats, self.stats = self.stats, Counter()
+        return stats
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+    
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeHostHandler(BaseHTTPRequestHandler):
+    """マニフェストとメディアを合成して返す"""
+    # GET/HEAD /<name>.mp4                 プログレッシブMP4（Rangeに対応）
+    # GET      /hls/<name>.m3u8            HLSのメディアプレイリスト
+    # GET      /hls/<name>/<n>.ts          HLSのセグメント
+    # GET      /dash/<name>.mpd            DASHのMPD
+    # GET      /dash/<name>/init.mp4, <n>.m4s  DASHの初期化セグメント・セグメント
+    protocol_version = "HTTP/1.1"
+    
+    @property
+    def fake_host(self):
+        return self.server.fake_host
+    
+    def setup(self):
+        super().setup()
+        self.fake_host.count(connections=1)
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_HEAD(self):
+        self._handle(head=True)
+    
+    def do_GET(self):
+        self._handle(head=False)
+    
+    def _handle(self, head):
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split("/") if part]
+        self.fake_host.count(requests=1)
+        if not parts:
+            self._send_error(404)
+            return
+        name, ext = os.path.splitext(parts[-1])
+        ext = ext.lstrip(".")
+        
+        if len(parts) == 1 and ext == "mp4":
+            params = parse_params(name, parsed.query)
+            self._send_media(params, params["size"], "mp4", head)
+        elif len(parts) == 2 and parts[0] == "hls" and ext == "m3u8":
+            params = parse_params(name, parsed.query)
+            self._send_manifest(build_m3u8(params, parsed.query), "m3u8", params, head)
+        elif len(parts) == 2 and parts[0] == "dash" and ext == "mpd":
+            params = parse_params(name, parsed.query)
+            self._send_manifest(build_mpd(params, parsed.query), "mpd", params, head)
+        elif len(parts) == 3 and parts[0] in ("hls", "dash") and ext in ("ts", "m4s", "mp4"):
+            params = parse_params(parts[1], parsed.query)
+            size = 1024 if name == "init" else params["segment_size"]
+            self._send_media(params, size, ext, head)
+        else:
+            self._send_error(404)
+    
+    def _send_manifest(self, text, ext, params, head):
+        if params["latency"]:
+            time.sleep(params["latency"])
+        data = text.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[ext])
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+    
+    def _send_media(self, params, size, ext, head):
+        if params["latency"]:
+            time.sleep(params["latency"])
+        if not head and params["error_rate"] and random.random() < params["error_rate"]:
+            self.fake_host.count(injected_errors=1)
+            self._send_error(params["error_status"])
+            return
+        
+        start, end = 0, size - 1
+        range_header = self.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            if start >= size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPES[ext])
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not head:
+            self._write_payload(start, end - start + 1, params["rate"])
+    
+    def _write_payload(self, offset, length, rate):
+        """length バイトを送る。rateが指定されていれば接続ごとの帯域をその値に抑える"""
+        started = time.monotonic()
+        sent = 0
+        block_size = len(PAYLOAD_BLOCK)
+        try:
+            while sent < length:
+                position = (offset + sent) % block_size
+                chunk = PAYLOAD_BLOCK[position:position + min(WRITE_CHUNK, length - sent)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if rate:
+                    ahead = sent / rate - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        finally:
+            self.fake_host.count(bytes_sent=sent)
+    
+    def _send_error(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマーク用の疑似動画ホストを起動する")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+    
+    fake_host = FakeVideoHost(args.host, args.port)
+    print(f"🎞 {fake_host.url('mp4', 'sample', size=DEFAULT_SIZE)}")
+    print(f"🎞 {fake_host.url('hls', 'sample', segments=DEFAULT_SEGMENTS)}")
+    print(f"🎞 {fake_host.url('dash', 'sample', segments=DEFAULT_SEGMENTS, latency=50, rate=2000)}")
+    try:
+        fake_host.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake_host.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
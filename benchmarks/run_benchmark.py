@@ -0,0 +1,278 @@
+"""
+ダウンロードエンジンのベンチマーク
+疑似動画ホストに対してDownloadEngineをGUIなしで動かし、同時DL数・フラグメント並列数の組み合わせごとに
+転送速度・最初のデータ受信までの時間・スケジューラのオーバーヘッド・進捗通知の頻度を計測する
+    
+    python benchmarks/run_benchmark.py --kind hls --count 20 --segments 30 --jobs 1,2,4 --fragments 1,4,8
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+from collections import Counter, deque
+
+# 設定・履歴・アーカイブは一時フォルダに作る（利用者の ~/.video_downloader に触れないように）
+BENCHMARK_HOME = tempfile.mkdtemp(prefix="video_downloader_bench_")
+os.environ["HOME"] = BENCHMARK_HOME
+os.environ["USERPROFILE"] = BENCHMARK_HOME
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from downloader_engine import DownloadEngine, POST_PROCESSING_MODES, TASK_RESULT_LABELS  # noqa: E402
+from fake_host import FakeVideoHost  # noqa: E402
+
+# 画面側の進捗の取り出しを模擬する頻度（Hz）
+DEFAULT_UI_HZ = 10
+
+
+def parse_int_list(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def percentile(values, ratio):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * ratio), len(values) - 1)]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="疑似動画ホストに対してダウンロードエンジンの性能を計測する")
+    parser.add_argument("--kind", choices=("mp4", "hls", "dash"), default="mp4", help="配信形式")
+    parser.add_argument("--count", type=int, default=10, help="動画の数")
+    parser.add_argument("--size", type=int, default=5 * 1024 * 1024, help="MP4のサイズ（バイト）")
+    parser.add_argument("--segments", type=int, default=20, help="HLS/DASHのセグメント数")
+    parser.add_argument("--segment-size", type=int, default=256 * 1024, help="セグメントのサイズ（バイト）")
+    parser.add_argument("--latency", type=float, default=0, help="応答までの遅延（ミリ秒）")
+    parser.add_argument("--rate", type=float, default=0, help="接続ごとの帯域（KB/s、0は無制限）")
+    parser.add_argument("--error-rate", type=float, default=0, help="メディアの要求のうちエラーを返す割合（0〜1）")
+    parser.add_argument("--error-status", type=int, default=503, help="注入するエラーのステータス")
+    parser.add_argument("--hosts", type=int, default=1,
+                        help="ホスト数（127.0.0.1, 127.0.0.2, ... で別々に起動する。Linux/Windowsのみ）")
+    parser.add_argument("--jobs", type=parse_int_list, default=[2], help="同時ダウンロード数（カンマ区切りで複数）")
+    parser.add_argument("--fragments", type=parse_int_list, default=[4], help="フラグメント並列数（カンマ区切りで複数）")
+    parser.add_argument("--connection-budget", type=int, default=64, help="全タスク合計の接続数の予算")
+    parser.add_argument("--per-host", type=int, default=0, help="ホスト毎の同時ダウンロード数の上限（0は無制限）")
+    parser.add_argument("--limit-rate", type=int, default=0, help="全体の帯域上限（KB/s、0は無制限）")
+    parser.add_argument("--post-processing", choices=list(POST_PROCESSING_MODES), default="remux")
+    parser.add_argument("--ui-hz", type=int, default=DEFAULT_UI_HZ, help="進捗を取り出す頻度（画面の更新頻度を模擬）")
+    parser.add_argument("--repeat", type=int, default=1, help="組み合わせごとの繰り返し回数")
+    parser.add_argument("--json", metavar="FILE", help="結果をJSONで保存する（実行間の比較用）")
+    return parser
+
+
+class SchedulerProbe:
+    """エンジンのスケジューリング処理を包んで時間を測る"""
+    # 取り出し: _pop_dispatchable_taskの所要時間
+    # 受け渡し: ダウンロードの完了から、空いた枠で次のタスクが始まるまでの時間
+    def __init__(self, engine):
+        self.lock = threading.Lock()
+        self.pop_times = []
+        self.handoffs = []
+        self.freed = deque()
+        pop = engine._pop_dispatchable_task
+        download = engine._download_video
+        done = engine._on_download_done
+        
+        def timed_pop():
+            started = time.perf_counter()
+            task = pop()
+            if task is not None:
+                self.pop_times.append(time.perf_counter() - started)
+            return task
+        
+        def timed_download(task, save_dir):
+            with self.lock:
+                if self.freed:
+                    self.handoffs.append(time.perf_counter() - self.freed.popleft())
+            return download(task, save_dir)
+        
+        def timed_done(task, future):
+            # 枠が解放される前に記録する（解放直後に次のタスクが始まることがあるため）
+            with self.lock:
+                self.freed.append(time.perf_counter())
+            done(task, future)
+        
+        engine._pop_dispatchable_task = timed_pop
+        engine._download_video = timed_download
+        engine._on_download_done = timed_done
+
+
+class UIConsumer:
+    """画面の更新ティックと同じ頻度で進捗ボードを取り出し、反映した行数を数える"""
+    def __init__(self, engine, hz):
+        self.engine = engine
+        self.interval = 1.0 / max(hz, 1)
+        self.ticks = 0
+        self.rows = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+    
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.ticks += 1
+            self.rows += len(self.engine.progress_board.drain())
+            self.engine.stats()
+
+
+def run_once(args, hosts, jobs, fragments):
+    """1つの組み合わせでキューを最後まで処理し、計測値を返す"""
+    settings = {
+        "concurrent_downloads": jobs,
+        "concurrent_fragments": fragments,
+        "connection_budget": args.connection_budget,
+        "per_host_limit": args.per_host,
+        "bandwidth_limit": args.limit_rate,
+        "post_processing": args.post_processing,
+        "skip_existing": False,
+    }
+    work_dir = tempfile.mkdtemp(prefix="run_", dir=BENCHMARK_HOME)
+    output_dir = os.path.join(work_dir, "out")
+    os.makedirs(output_dir)
+    engine = DownloadEngine(settings, journal_path=os.path.join(work_dir, "queue_journal.jsonl"))
+    probe = SchedulerProbe(engine)
+    ui = UIConsumer(engine, args.ui_hz)
+    
+    events = Counter()
+    results = Counter()
+    errors = Counter()
+    finished = []
+    
+    def on_event(event, data):
+        events[event] += 1
+        if event == "task_finished":
+            results[data["entry"]["status"]] += 1
+            if data["task"].error_kind:
+                errors[data["task"].error_kind] += 1
+            finished.append(dict(data["task"].timings))
+    
+    engine.add_listener(on_event)
+    for host in hosts:
+        host.reset_stats()
+    
+    # ホストをまたいで交互に並ぶように追加する（ホスト毎のスケジューリングの効果を見る）
+    urls = []
+    for index in range(args.count):
+        host = hosts[index % len(hosts)]
+        urls.append(host.url(args.kind, f"v{index}", size=args.size, segments=args.segments,
+                             segment_size=args.segment_size, latency=args.latency or None,
+                             rate=args.rate or None, error_rate=args.error_rate or None,
+                             error_status=args.error_status if args.error_rate else None))
+    engine.enqueue(urls)
+    
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    ui.start()
+    engine.start(output_dir)
+    engine.stop_when_idle()
+    engine.wait()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    ui.stop()
+    engine.close()
+    
+    server = Counter()
+    for host in hosts:
+        server.update(host.reset_stats())
+    metrics = engine.metrics.snapshot()
+    received = metrics["counters"].get("bytes", {}).get("", 0)
+    ttfb = [timings["ttfb"] for timings in finished if "ttfb" in timings]
+    extract = [timings["extract"] for timings in finished if "extract" in timings]
+    shutil.rmtree(work_dir, ignore_errors=True)
+    
+    board = engine.progress_board
+    return {
+        "jobs": jobs,
+        "fragments": fragments,
+        "elapsed": elapsed,
+        "cpu": cpu,
+        "bytes": received,
+        "throughput": received / elapsed if elapsed > 0 else 0.0,
+        "results": {TASK_RESULT_LABELS.get(status, status): count for status, count in results.items()},
+        "errors": dict(errors),
+        "retries": sum(metrics["counters"].get("retries", {}).values()),
+        "ttfb_p50": percentile(ttfb, 0.5),
+        "ttfb_p95": percentile(ttfb, 0.95),
+        "extract_p50": percentile(extract, 0.5),
+        "dispatch_mean": sum(probe.pop_times) / len(probe.pop_times) if probe.pop_times else None,
+        "handoff_mean": sum(probe.handoffs) / len(probe.handoffs) if probe.handoffs else None,
+        "handoff_p95": percentile(probe.handoffs, 0.95),
+        "progress_events": board.event_count,
+        "progress_events_per_sec": board.event_count / elapsed if elapsed > 0 else 0.0,
+        "ui_rows_per_sec": ui.rows / elapsed if elapsed > 0 else 0.0,
+        "listener_events": dict(events),
+        "server_requests": server["requests"],
+        "server_connections": server["connections"],
+        "injected_errors": server["injected_errors"],
+    }
+
+
+def format_ms(seconds):
+    return f"{seconds * 1000:.1f}" if seconds is not None else "-"
+
+
+def print_table(rows):
+    header = ("jobs", "frag", "秒", "MB/s", "成功/失敗", "再試行", "TTFB p50/p95 ms", "取り出し µs", "受け渡し ms",
+              "進捗/s", "UI行/s", "CPU秒", "接続/要求", "失敗理由")
+    lines = [header]
+    for row in rows:
+        results = row["results"]
+        dispatch = f"{row['dispatch_mean'] * 1e6:.0f}" if row["dispatch_mean"] is not None else "-"
+        lines.append((
+            str(row["jobs"]),
+            str(row["fragments"]),
+            f"{row['elapsed']:.2f}",
+            f"{row['throughput'] / 1024 / 1024:.2f}",
+            f"{results.get('success', 0)}/{results.get('failed', 0)}",
+            str(row["retries"]),
+            f"{format_ms(row['ttfb_p50'])}/{format_ms(row['ttfb_p95'])}",
+            dispatch,
+            format_ms(row["handoff_mean"]),
+            f"{row['progress_events_per_sec']:.0f}",
+            f"{row['ui_rows_per_sec']:.0f}",
+            f"{row['cpu']:.2f}",
+            f"{row['server_connections']}/{row['server_requests']}",
+            " ".join(f"{kind}×{count}" for kind, count in row["errors"].items()) or "-",
+        ))
+    widths = [max(len(line[index]) for line in lines) for index in range(len(header))]
+    for line in lines:
+        print("  ".join(value.rjust(width) for value, width in zip(line, widths)).rstrip())
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    hosts = [FakeVideoHost(f"127.0.0.{index + 1}").start() for index in range(max(args.hosts, 1))]
+    rows = []
+    try:
+        for jobs in args.jobs:
+            for fragments in args.fragments:
+                for _ in range(args.repeat):
+                    row = run_once(args, hosts, jobs, fragments)
+                    rows.append(row)
+                    print(f"… jobs={jobs} fragments={fragments}: {row['elapsed']:.2f}s", file=sys.stderr)
+    finally:
+        for host in hosts:
+            host.shutdown()
+        shutil.rmtree(BENCHMARK_HOME, ignore_errors=True)
+    
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "runs": rows}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
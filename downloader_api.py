@@ -0,0 +1,413 @@
+"""
+ダウンロードエンジンのローカルHTTP/JSON API
+常駐中のプロセスへ他のツールからURLを投入し、進捗を監視する（127.0.0.1のみで待ち受ける）
+"""
+
+import json
+import time
+import queue
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+
+from downloader_engine import MAX_RETRIES, PRIORITY_LEVELS, iter_import_urls
+
+API_HOST = "127.0.0.1"
+# リクエスト本文の上限（バイト）
+MAX_REQUEST_BYTES = 10 * 1024 * 1024
+# イベントストリームで進捗を送る間隔（秒）と、購読者ごとに溜めておくイベント数の上限
+EVENT_PROGRESS_INTERVAL = 1.0
+EVENT_QUEUE_SIZE = 1000
+# 展開ありの投入でキューへ1回に追加する件数
+ENQUEUE_BATCH_SIZE = 200
+# /metricsで公開する計測値の名前の接頭辞
+METRICS_PREFIX = "video_downloader"
+
+
+def task_to_dict(state, task, snapshot=None):
+    """タスクの状態をJSONで返せる辞書にする（snapshotは進捗ボードの最新状態）"""
+    snapshot = snapshot or {}
+    if state == "pending" and task.disk_wait:
+        status = "容量待ち"
+    elif state == "pending":
+        status = "中断" if task.resumed else "待機中"
+    elif state == "paused":
+        status = "一時停止"
+    elif state == "retrying":
+        status = f"再試行待ち（{task.attempts}/{MAX_RETRIES}）"
+    else:
+        status = snapshot.get("status", "DL中" if state == "active" else "後処理待ち")
+    return {
+        "id": task.task_id,
+        "url": task.url,
+        "title": task.title,
+        "host": task.host,
+        "state": state,
+        "status": status,
+        "priority": task.priority,
+        "progress": snapshot.get("progress", task.progress),
+        "speed": task.speed if state == "active" else 0.0,
+        "eta": task.eta if state == "active" else None,
+        "downloaded_bytes": task.downloaded_bytes,
+        "total_bytes": task.estimated_total,
+        "cancel_requested": task.cancel_requested,
+        "error": task.error,
+        "error_kind": task.error_kind,
+        "attempts": task.attempts,
+    }
+
+
+def render_prometheus(stats, metrics):
+    """集計値（engine.stats()）と計測値（PipelineMetrics.snapshot()）をPrometheusのテキスト形式にする"""
+    lines = []
+    
+    def add(name, kind, help_text, samples):
+        lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+            lines.append(f"{METRICS_PREFIX}_{name}{suffix}{{{label_text}}} {value}" if label_text
+                         else f"{METRICS_PREFIX}_{name}{suffix} {value}")
+    
+    for key, name, help_text in (
+        ("active", "active_tasks", "ダウンロード中のタスク数"),
+        ("pending", "pending_tasks", "待機中（再試行待ちを含む）のタスク数"),
+        ("retrying", "retrying_tasks", "再試行待ちのタスク数"),
+        ("postprocessing", "postprocessing_tasks", "後処理中のタスク数"),
+        ("limit", "concurrency_limit", "同時ダウンロード数の上限"),
+        ("connections", "connections_in_use", "使用中のフラグメント接続数"),
+        ("rate", "download_rate_bytes", "合計転送速度（バイト/秒）"),
+        ("bandwidth_limit", "bandwidth_limit_bytes", "全体の帯域上限（バイト/秒、0は無制限）"),
+    ):
+        add(name, "gauge", help_text, [("", {}, stats[key])])
+    add("disk_waiting", "gauge", "空き容量不足でタスクを待たせているか（1/0）", [("", {}, int(stats["disk_waiting"]))])
+    
+    counters = metrics["counters"]
+    add("downloaded_bytes_total", "counter", "受信したバイト数", [("", {}, counters.get("bytes", {}).get("", 0))])
+    for name, label, help_text in (
+        ("tasks", "result", "完了したタスク数"),
+        ("errors", "kind", "失敗したタスク数（原因別）"),
+        ("retries", "kind", "再試行の回数（原因別）"),
+    ):
+        add(f"{name}_total", "counter", help_text,
+            [("", {label: value_label}, value) for value_label, value in sorted(counters.get(name, {}).items())])
+    
+    stages = metrics["stages"]
+    add("stage_seconds", "summary", "段階ごとの所要時間（秒）",
+        [(suffix, {"stage": stage}, summary[key]) for stage, summary in stages.items()
+         for suffix, key in (("_sum", "sum"), ("_count", "count"))])
+    add("stage_seconds_max", "gauge", "段階ごとの最大所要時間（秒）",
+        [("", {"stage": stage}, summary["max"]) for stage, summary in stages.items()])
+    return "\n".join(lines) + "\n"
+
+
+class EventHub:
+    """エンジンからの通知を購読者（イベントストリームの接続）ごとのキューへ配る"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+    
+    def subscribe(self):
+        subscription = queue.Queue(maxsize=EVENT_QUEUE_SIZE)
+        with self.lock:
+            self.subscribers.add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+    
+    def publish(self, event, data):
+        """DownloadEngineのリスナーとして登録する（ワーカースレッドから呼ばれる）"""
+        payload = self._serialize(event, data)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.put_nowait((event, payload))
+            except queue.Full:
+                # 読み出しの遅い購読者の分は捨てる（進捗は定期送信で追いつく）
+                pass
+    
+    def _serialize(self, event, data):
+        if event == "queued":
+            return {"tasks": [task_to_dict("pending", task) for task in data["tasks"]]}
+        if event == "task_finished":
+            task = data["task"]
+            return {"id": task.task_id, "error": task.error, "error_kind": task.error_kind, "entry": data["entry"]}
+        return data
+
+
+class ControlServer:
+    """DownloadEngineを操作するHTTPサーバー"""
+    def __init__(self, engine, port, host=API_HOST):
+        self.engine = engine
+        self.hub = EventHub()
+        engine.add_listener(self.hub.publish)
+        self.httpd = ThreadingHTTPServer((host, port), ControlRequestHandler)
+        # イベントストリームの接続が終了を妨げないように
+        self.httpd.daemon_threads = True
+        self.httpd.control = self
+        self.thread = None
+    
+    @property
+    def address(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+    
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+    
+    def snapshot(self):
+        """全タスクの進捗と全体の集計値"""
+        board = self.engine.progress_board
+        tasks = [task_to_dict(state, task, board.get(task.task_id)) for state, task in self.engine.list_tasks()]
+        return {"tasks": tasks, "stats": self.engine.stats(), "running": self.engine.is_running}
+    
+    def submit(self, urls, expand=False):
+        """URLをキューへ追加する。展開ありの場合は別スレッドで順次追加し、件数だけ返す"""
+        if expand:
+            threading.Thread(target=self._submit_expanded, args=(urls,), daemon=True).start()
+            return {"accepted": len(urls)}
+        
+        invalid = []
+        valid = list(iter_import_urls(urls, report=invalid.append))
+        added, duplicates, skipped = self.engine.enqueue(valid)
+        return {
+            "added": [task_to_dict("pending", task) for task in added],
+            "duplicates": duplicates,
+            "skipped": skipped,
+            "invalid": len(invalid),
+        }
+    
+    def _submit_expanded(self, urls):
+        batch = []
+        for url in iter_import_urls(urls, expand=True):
+            batch.append(url)
+            if len(batch) >= ENQUEUE_BATCH_SIZE:
+                self.engine.enqueue(batch)
+                batch = []
+        if batch:
+            self.engine.enqueue(batch)
+
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    """APIのリクエストを処理する"""
+    # GET    /tasks              全タスクと集計値
+    # GET    /tasks/<id>         1件の状態
+    # POST   /tasks              {"urls": [...], "expand": false} を追加
+    # POST   /tasks/<id>/cancel  1件を中止（DELETE /tasks/<id> も同じ）
+    # POST   /tasks/<id>/pause   一時停止（.partを残す） / resume で再開
+    # POST   /tasks/<id>/move    {"position": "top" | "bottom"}
+    # POST   /tasks/<id>/priority {"priority": 0〜2}（0が最優先）
+    # POST   /retry-failed       履歴で失敗したURLをまとめて再投入
+    # GET    /stats              集計値のみ
+    # GET    /metrics            Prometheusのテキスト形式の計測値
+    # GET    /events             Server-Sent Eventsで通知と進捗を配信
+    protocol_version = "HTTP/1.1"
+    
+    @property
+    def control(self):
+        return self.server.control
+    
+    def log_message(self, format, *args):
+        # アクセスログは出さない
+        pass
+    
+    def do_GET(self):
+        if not self._check_request():
+            return
+        parts = self._path_parts()
+        if parts == ["tasks"]:
+            self._send_json(200, self.control.snapshot())
+        elif len(parts) == 2 and parts[0] == "tasks":
+            self._send_task(parts[1])
+        elif parts == ["stats"]:
+            self._send_json(200, self.control.engine.stats())
+        elif parts == ["metrics"]:
+            engine = self.control.engine
+            data = render_prometheus(engine.stats(), engine.metrics.snapshot()).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        elif parts == ["events"]:
+            self._stream_events()
+        else:
+            self._send_json(404, {"error": "not found"})
+    
+    def do_POST(self):
+        if not self._check_request(require_json=True):
+            return
+        parts = self._path_parts()
+        if parts == ["tasks"]:
+            body = self._read_json()
+            if body is None:
+                return
+            urls = body.get("urls") or ([body["url"]] if body.get("url") else [])
+            if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+                self._send_json(400, {"error": "urls must be a list of strings"})
+                return
+            result = self.control.submit(urls, bool(body.get("expand")))
+            self._send_json(202 if "accepted" in result else 201, result)
+        elif len(parts) == 3 and parts[0] == "tasks" and parts[2] == "cancel":
+            self._cancel_task(parts[1])
+        elif len(parts) == 3 and parts[0] == "tasks" and parts[2] in ("pause", "resume", "move", "priority"):
+            self._control_task(parts[1], parts[2])
+        elif parts == ["retry-failed"]:
+            added, duplicates, skipped = self.control.engine.retry_failed()
+            self._send_json(201, {"added": [task_to_dict("pending", task) for task in added],
+                                  "duplicates": duplicates, "skipped": skipped})
+        else:
+            self._send_json(404, {"error": "not found"})
+    
+    def do_DELETE(self):
+        if not self._check_request():
+            return
+        parts = self._path_parts()
+        if len(parts) == 2 and parts[0] == "tasks":
+            self._cancel_task(parts[1])
+        else:
+            self._send_json(404, {"error": "not found"})
+    
+    def _check_request(self, require_json=False):
+        """ブラウザで開いた他のサイトからの要求を拒否する。拒否した場合はエラーを返してFalse"""
+        # DNSリバインディングで別の名前から届いた要求は、Hostが127.0.0.1/localhostにならない
+        port = self.server.server_address[1]
+        if self.headers.get("Host", "").lower() not in (f"127.0.0.1:{port}", f"localhost:{port}"):
+            self.close_connection = True
+            self._send_json(403, {"error": "invalid Host"})
+            return False
+        # application/jsonはCORSのプリフライトが必要なため、他のサイトのページからは送れない（本文なしのPOSTも同じ）
+        if require_json and self.headers.get_content_type() != "application/json":
+            self.close_connection = True
+            self._send_json(415, {"error": "Content-Type must be application/json"})
+            return False
+        return True
+    
+    def _path_parts(self):
+        return [part for part in urlparse(self.path).path.split("/") if part]
+    
+    def _parse_task_id(self, value):
+        try:
+            return int(value)
+        except ValueError:
+            self._send_json(400, {"error": "invalid task id"})
+            return None
+    
+    def _send_task(self, value):
+        task_id = self._parse_task_id(value)
+        if task_id is None:
+            return
+        state, task = self.control.engine.get_task(task_id)
+        if task is None:
+            self._send_json(404, {"error": "task not found"})
+            return
+        self._send_json(200, task_to_dict(state, task, self.control.engine.progress_board.get(task_id)))
+    
+    def _cancel_task(self, value):
+        task_id = self._parse_task_id(value)
+        if task_id is None:
+            return
+        if not self.control.engine.cancel(task_id):
+            self._send_json(404, {"error": "task not found"})
+            return
+        self._send_json(200, {"id": task_id, "cancelled": True})
+    
+    def _control_task(self, value, action):
+        task_id = self._parse_task_id(value)
+        if task_id is None:
+            return
+        engine = self.control.engine
+        if engine.get_task(task_id)[1] is None:
+            self._send_json(404, {"error": "task not found"})
+            return
+        body = self._read_json() if action in ("move", "priority") else {}
+        if body is None:
+            return
+        
+        if action == "pause":
+            engine.pause([task_id])
+        elif action == "resume":
+            engine.resume([task_id])
+        elif action == "move":
+            if body.get("position") not in ("top", "bottom"):
+                self._send_json(400, {"error": "position must be top or bottom"})
+                return
+            engine.move([task_id], body["position"] == "top")
+        else:
+            # JSONのtrue/falseはPythonではintの一種なので別に弾く
+            priority = body.get("priority")
+            if not isinstance(priority, int) or isinstance(priority, bool) or priority not in PRIORITY_LEVELS:
+                self._send_json(400, {"error": f"priority must be one of {list(PRIORITY_LEVELS)}"})
+                return
+            engine.set_priority([task_id], priority)
+        state, task = engine.get_task(task_id)
+        self._send_json(200, task_to_dict(state, task, engine.progress_board.get(task_id)) if task else {"id": task_id})
+    
+    def _read_json(self):
+        """本文をJSONとして読む。不正な場合はエラーを返してNone"""
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_REQUEST_BYTES:
+            self._send_json(413 if length > 0 else 400, {"error": "invalid Content-Length"})
+            return None
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": "invalid JSON"})
+            return None
+        if not isinstance(body, dict):
+            self._send_json(400, {"error": "JSON object expected"})
+            return None
+        return body
+    
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def _stream_events(self):
+        """エンジンの通知をそのまま流し、合間に一定間隔で進捗のスナップショットを送る"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        
+        hub = self.control.hub
+        subscription = hub.subscribe()
+        next_progress = time.monotonic()
+        try:
+            while True:
+                timeout = next_progress - time.monotonic()
+                if timeout <= 0:
+                    self._write_event("progress", self.control.snapshot())
+                    next_progress = time.monotonic() + EVENT_PROGRESS_INTERVAL
+                    continue
+                try:
+                    event, payload = subscription.get(timeout=timeout)
+                except queue.Empty:
+                    continue
+                self._write_event(event, payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            hub.unsubscribe(subscription)
+    
+    def _write_event(self, event, payload):
+        data = json.dumps(payload, ensure_ascii=False)
+        self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode("utf-8"))
+        self.wfile.flush()
@@ -0,0 +1,184 @@
+"""
+動画ダウンローダーのコマンドライン版
+tkinterを使わずにダウンロードエンジンを動かす（ヘッドレス環境・cron・常駐用）
+"""
+
+import os
+import sys
+import argparse
+import threading
+from collections import Counter
+
+from downloader_api import ControlServer
+from downloader_engine import (
+    DownloadEngine,
+    ERROR_KINDS,
+    MAX_BANDWIDTH_LIMIT,
+    MAX_CONCURRENT_DOWNLOADS,
+    MAX_CONCURRENT_FRAGMENTS,
+    POST_PROCESSING_MODES,
+    SETTINGS_DIR,
+    format_stats,
+    iter_import_urls,
+    load_settings,
+)
+
+# GUIとは別のジャーナルを使う（GUIのキューを巻き込まないように）
+CLI_QUEUE_JOURNAL_FILE = os.path.join(SETTINGS_DIR, "cli_queue_journal.jsonl")
+
+# 進捗を表示する間隔（秒）とキューへ1回に追加する件数
+PROGRESS_INTERVAL = 5.0
+ENQUEUE_BATCH_SIZE = 200
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="video_downloader.py --cli",
+        description="GUIを使わずに動画をダウンロードする。URLは引数・ファイル・標準入力から指定できる",
+    )
+    parser.add_argument("urls", nargs="*", help="ダウンロードするURL")
+    parser.add_argument("-i", "--input", action="append", default=[], metavar="FILE",
+                        help="URLを1行に1つずつ書いたファイル（-で標準入力。複数指定可）")
+    parser.add_argument("-o", "--output", metavar="DIR", help="保存先（省略時は設定の保存先）")
+    parser.add_argument("-j", "--jobs", type=int, help=f"同時ダウンロード数（1〜{MAX_CONCURRENT_DOWNLOADS}）")
+    parser.add_argument("--adaptive", action="store_true", help="同時ダウンロード数を自動調整する")
+    parser.add_argument("--fragments", type=int, help=f"フラグメント並列数（1〜{MAX_CONCURRENT_FRAGMENTS}）")
+    parser.add_argument("--limit-rate", type=int, metavar="KBPS",
+                        help="全体の帯域上限（KB/s、0で無制限）。ホスト毎・時間帯の上限は設定ファイルで指定する")
+    parser.add_argument("--post-processing", choices=list(POST_PROCESSING_MODES), help="後処理モード")
+    parser.add_argument("--staging-dir", metavar="DIR",
+                        help="ダウンロード・結合を行う作業フォルダ（高速なローカルディスク向け。仕上がったファイルだけを保存先へ移す）")
+    parser.add_argument("--expand", action="store_true", help="プレイリスト・チャンネルを動画ごとに展開する")
+    parser.add_argument("--no-skip-existing", action="store_true", help="取得済みの動画もダウンロードする")
+    parser.add_argument("--resume", action="store_true", help="前回中断したコマンドライン版のキューを再開する")
+    parser.add_argument("--retry-failed", action="store_true", help="履歴で失敗したURLをまとめて再投入する")
+    parser.add_argument("--daemon", action="store_true",
+                        help="キューが空になっても終了せず、標準入力から追加されるURLを待ち続ける")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="127.0.0.1:PORTでHTTP/JSON APIを公開して常駐する（--daemonを含む）")
+    parser.add_argument("--metrics-log", nargs="?", const=True, metavar="FILE",
+                        help="タスクごとの所要時間と全体の集計値をJSON Linesで記録する（省略時は設定フォルダのmetrics.jsonl）")
+    parser.add_argument("-q", "--quiet", action="store_true", help="進捗とステータスを表示しない")
+    return parser
+
+
+def apply_overrides(settings, args):
+    """コマンドラインの指定で設定を上書きする（設定ファイルには保存しない）"""
+    settings = dict(settings)
+    if args.jobs is not None:
+        settings["concurrent_downloads"] = max(1, min(args.jobs, MAX_CONCURRENT_DOWNLOADS))
+    if args.adaptive:
+        settings["adaptive_concurrency"] = True
+    if args.fragments is not None:
+        settings["concurrent_fragments"] = max(1, min(args.fragments, MAX_CONCURRENT_FRAGMENTS))
+    if args.limit_rate is not None:
+        settings["bandwidth_limit"] = max(0, min(args.limit_rate, MAX_BANDWIDTH_LIMIT))
+    if args.post_processing:
+        settings["post_processing"] = args.post_processing
+    if args.staging_dir is not None:
+        settings["staging_dir"] = args.staging_dir
+    if args.no_skip_existing:
+        settings["skip_existing"] = False
+    if args.metrics_log:
+        settings["metrics_log"] = args.metrics_log
+    return settings
+
+
+def iter_sources(args):
+    """引数・ファイル・標準入力の順にURLの行を返す"""
+    yield from args.urls
+    for path in args.input:
+        if path == "-":
+            yield from sys.stdin
+            continue
+        with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+            yield from f
+    # 何も指定されずパイプで渡された場合、または常駐時は標準入力を読む
+    if not args.urls and not args.input and (args.daemon or not sys.stdin.isatty()):
+        yield from sys.stdin
+
+
+def feed(engine, args, ingest_stats):
+    """URLを読み込みながら一定件数ずつキューへ追加する"""
+    batch = []
+    try:
+        for url in iter_import_urls(iter_sources(args), args.expand, lambda kind: ingest_stats.update((kind,))):
+            batch.append(url)
+            # 標準入力から1行ずつ届く場合は待たずに追加する
+            if len(batch) >= ENQUEUE_BATCH_SIZE or args.daemon:
+                engine.enqueue(batch)
+                batch = []
+        if batch:
+            engine.enqueue(batch)
+    except IOError as e:
+        print(f"❌ 読み込みに失敗しました: {e}", file=sys.stderr)
+    finally:
+        if not args.daemon:
+            engine.stop_when_idle()
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.serve is not None:
+        args.daemon = True
+    if not (args.urls or args.input or args.resume or args.retry_failed or args.daemon) and sys.stdin.isatty():
+        parser.error("URLを引数・ファイル(-i)・標準入力のいずれかで指定してください")
+    settings = apply_overrides(load_settings(), args)
+    save_dir = args.output or settings.get("save_path") or os.getcwd()
+    
+    engine = DownloadEngine(settings, journal_path=CLI_QUEUE_JOURNAL_FILE)
+    results = Counter()
+    ingest_stats = Counter()
+    
+    def on_event(event, data):
+        if event == "task_finished":
+            entry = data["entry"]
+            results[entry["status"]] += 1
+            # 結果は標準出力へタブ区切りで出す（スクリプトから扱えるように）
+            print(f"{entry['status']}\t{entry['url']}\t{entry['title']}", flush=True)
+            task = data["task"]
+            if entry["status"] == "❌" and task.error:
+                print(f"❌ {entry['url']}: [{ERROR_KINDS[task.error_kind]}] {task.error}", file=sys.stderr)
+        elif not args.quiet and event in ("status", "finished"):
+            print(data.get("message") or data.get("summary"), file=sys.stderr)
+    
+    engine.add_listener(on_event)
+    if args.resume:
+        engine.restore_queue()
+    if args.retry_failed:
+        engine.retry_failed()
+    
+    server = None
+    if args.serve is not None:
+        try:
+            server = ControlServer(engine, args.serve)
+        except OSError as e:
+            print(f"❌ APIを開始できません: {e}", file=sys.stderr)
+            engine.close()
+            return 2
+    
+    # 常駐しない場合は、容量不足で進めなくなったタスクを失敗として報告して終了する
+    if not engine.start(save_dir, keep_alive=True, fail_on_disk_shortfall=not args.daemon):
+        engine.close()
+        return 2
+    if server is not None:
+        server.start()
+        print(f"🌐 API: {server.address}", file=sys.stderr)
+    threading.Thread(target=feed, args=(engine, args, ingest_stats), daemon=True).start()
+    
+    try:
+        while not engine.wait(PROGRESS_INTERVAL):
+            if not args.quiet and engine.active_tasks:
+                print(format_stats(engine.stats()), file=sys.stderr)
+    except KeyboardInterrupt:
+        engine.cancel_all()
+        engine.wait()
+    finally:
+        if server is not None:
+            server.shutdown()
+        engine.close()
+    
+    if ingest_stats["invalid"]:
+        print(f"⚠ URLでない行を{ingest_stats['invalid']}件無視しました", file=sys.stderr)
+    return 1 if results["❌"] else 0
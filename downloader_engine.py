@@ -0,0 +1,2513 @@
+"""
+ダウンロードエンジン
+キュー・スケジューリング・ダウンロード・後処理・履歴を扱う（tkinterに依存しない）
+"""
+
+import os
+import re
+import errno
+import json
+import time
+import random
+import shutil
+import hashlib
+import threading
+import subprocess
+import queue
+import heapq
+from datetime import datetime
+from collections import deque, Counter, OrderedDict
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import yt_dlp
+except ImportError:
+    print("yt-dlpがインストールされていません。以下のコマンドを実行してください:")
+    print("pip install yt-dlp")
+    exit(1)
+
+# 設定ファイルのパス
+SETTINGS_DIR = os.path.join(os.path.expanduser("~"), ".video_downloader")
+SETTINGS_FILE = os.path.join(SETTINGS_DIR, "settings.json")
+HISTORY_FILE = os.path.join(SETTINGS_DIR, "history.jsonl")
+LEGACY_HISTORY_FILE = os.path.join(SETTINGS_DIR, "history.json")
+# yt-dlpの--download-archiveと同じ形式（「抽出器 動画ID」を1行ずつ）
+DOWNLOAD_ARCHIVE_FILE = os.path.join(SETTINGS_DIR, "archive.txt")
+METADATA_CACHE_DIR = os.path.join(SETTINGS_DIR, "metadata_cache")
+QUEUE_JOURNAL_FILE = os.path.join(SETTINGS_DIR, "queue_journal.jsonl")
+METRICS_LOG_FILE = os.path.join(SETTINGS_DIR, "metrics.jsonl")
+
+# デフォルトの同時ダウンロード数
+DEFAULT_CONCURRENT_DOWNLOADS = 2
+MAX_CONCURRENT_DOWNLOADS = 10
+
+# 同時ダウンロード数の自動調整
+ADAPTIVE_START_DOWNLOADS = 2
+ADAPTIVE_INTERVAL = 5.0      # 評価間隔（秒）
+ADAPTIVE_GAIN = 0.1          # 枠を増やしたとき、これ以上速度が伸びなければ頭打ちと判断
+ADAPTIVE_HOLD_ROUNDS = 3     # 減らした後に再び増やすまで待つ評価回数
+HOST_THROTTLE_RELAX = 60.0   # 429で絞ったホストの上限を、429のないままこの秒数が過ぎるごとに1つ戻す
+
+# HLS/DASHのフラグメント並列数と、全タスク合計の接続数の予算
+DEFAULT_CONCURRENT_FRAGMENTS = 4
+MAX_CONCURRENT_FRAGMENTS = 16
+DEFAULT_CONNECTION_BUDGET = 16
+MAX_CONNECTION_BUDGET = 64
+
+# 後処理モード。remuxはmp4にそのまま格納できるコーデックを優先して選び、ストリームコピーのみ行う
+POST_PROCESSING_MODES = {
+    "remux": "リマックスのみ（再エンコードなし）",
+    "transcode": "再エンコード",
+}
+DEFAULT_POST_PROCESSING = "remux"
+MP4_VIDEO_CODECS = "^(avc|h264|hev|hvc|h265|av01)"
+MP4_AUDIO_CODECS = "^(mp4a|aac|opus)"
+REMUX_FORMAT = (
+    f"bv*[vcodec~='{MP4_VIDEO_CODECS}']+ba[acodec~='{MP4_AUDIO_CODECS}']"
+    f"/b[vcodec~='{MP4_VIDEO_CODECS}'][acodec~='{MP4_AUDIO_CODECS}']"
+    "/bestvideo+bestaudio/best"
+)
+# 後処理（ffmpeg）を同時に実行する数。CPU処理なのでダウンロード枠とは別にコア数から決める
+POST_PROCESS_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+POSTPROCESSOR_LABELS = {
+    "Merger": "結合",
+    "VideoRemuxer": "リマックス",
+    "VideoConvertor": "再エンコード",
+}
+
+# メタデータキャッシュの有効期間（分）。0で無効
+DEFAULT_METADATA_CACHE_TTL = 0
+MAX_METADATA_CACHE_TTL = 1440
+
+# 履歴の書き込みをまとめる間隔（秒）と、末尾から遡って読むときの1回の読み込みサイズ
+HISTORY_FLUSH_INTERVAL = 1.0
+HISTORY_READ_BLOCK = 64 * 1024
+
+# 合計転送速度を求める移動窓（秒）
+THROUGHPUT_WINDOW = 5.0
+
+# 計測する段階（秒）。計測ログには全体の集計値も一定間隔（秒）で書き出す
+METRIC_STAGES = ("queue_wait", "extract", "ttfb", "download", "postprocess", "history_write", "ui_loop_lag")
+METRICS_SNAPSHOT_INTERVAL = 10.0
+# 計測値で使う結果の名前
+TASK_RESULT_LABELS = {"✅": "success", "⏭": "skipped", "❌": "failed", "⏹": "cancelled"}
+
+# 帯域制限（KB/s、0は無制限）。バケットに溜められるのは上限の何秒分か、各タスクの配分を見直す間隔（秒）
+DEFAULT_BANDWIDTH_LIMIT = 0
+MAX_BANDWIDTH_LIMIT = 1000000
+BANDWIDTH_BURST = 1.0
+BANDWIDTH_REBALANCE_INTERVAL = 1.0
+# フラグメントを並列取得するプロトコル（ratelimitが接続ごとに効く）。それ以外は1本の接続で取得する
+FRAGMENTED_PROTOCOLS = ("m3u8", "http_dash_segments", "dash", "ism", "f4m")
+
+# 待機キューの優先度（値が小さいほど先に取り出す）
+PRIORITY_LEVELS = {
+    0: "高",
+    1: "通常",
+    2: "低",
+}
+DEFAULT_PRIORITY = 1
+
+# エラーの分類（履歴にも記録する）。一時的なものは間隔を空けてキューへ戻し、それ以外はすぐに失敗とする
+ERROR_KINDS = {
+    "timeout": "タイムアウト・接続断",
+    "throttled": "アクセス制限（429）",
+    "forbidden": "アクセス拒否（403）",
+    "not_found": "見つからない・非公開",
+    "extractor": "解析エラー",
+    "ffmpeg": "後処理エラー",
+    "disk_full": "空き容量不足",
+    "unknown": "不明なエラー",
+}
+# 403は署名付きのメディアURLの失効でも起きるため、解決し直して再試行する
+TRANSIENT_ERROR_KINDS = ("timeout", "throttled", "forbidden")
+HTTP_STATUS_PATTERN = re.compile(r"HTTP Error (\d{3})", re.IGNORECASE)
+NETWORK_ERROR_WORDS = (
+    "timed out", "timeout", "connection reset", "connection refused", "connection aborted",
+    "remote end closed", "incompleteread", "name resolution", "network is unreachable", "eof occurred",
+)
+EXTRACTOR_ERROR_WORDS = ("unsupported url", "unable to extract", "please report this issue", "extractor")
+UNAVAILABLE_ERROR_WORDS = ("video unavailable", "private video", "has been removed", "not available")
+
+# キューでの再試行の回数と待ち時間（秒）。待ち時間は回数ごとに倍にし、ばらつきを加えて一斉に再開しないようにする
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 300.0
+# yt-dlp内部の再試行（ワーカーを占有したまま繰り返すため少なめにし、残りはキューでの再試行に任せる）
+YTDLP_RETRIES = 3
+YTDLP_FRAGMENT_RETRIES = 5
+
+# ワーカースレッドごとに保持するYoutubeDLの数（ホスト・保存先・設定の組み合わせごとに1つ）
+YDL_POOL_SIZE = 8
+
+# 空き容量（MB）。実行中のタスクがこれから書き込む分を差し引いても、これだけ残る場合にだけ次のタスクを始める
+DEFAULT_MIN_FREE_SPACE = 512
+# 空き容量が足りずにタスクを待たせている間、空きを確かめ直す間隔（秒）
+DISK_RECHECK_INTERVAL = 15.0
+
+
+class DownloadTask:
+    """個別のダウンロードタスクを管理するクラス"""
+    def __init__(self, url, task_id):
+        self.url = url
+        self.task_id = task_id
+        self.host = get_host(url)
+        self.progress = 0.0
+        self.status = "待機中"
+        self.cancel_requested = False
+        self.title = ""
+        self.speed = 0.0
+        self.current_ydl = None
+        self.error = ""
+        self.connections = 1
+        # 後処理ごとの所要時間（秒）
+        self.postprocess_times = {}
+        self.ffmpeg_process = None
+        # 前回終了時にダウンロード途中だったタスク（.partから再開する）
+        self.resumed = False
+        # 待機キューでの優先度と順番。一時停止は中止と同じく止めるが、.partを残してキューに戻せる
+        self.priority = DEFAULT_PRIORITY
+        self.queue_order = 0
+        self.pause_requested = False
+        # 失敗の種類（ERROR_KINDS）と、一時的なエラーによる再試行の回数・再開する時刻
+        self.error_kind = ""
+        self.attempts = 0
+        self.retry_at = 0.0
+        # 空き容量が足りずにキューで待っている（サイズが分かった後の確認で足りなかった場合はワーカーが立てる）
+        self.disk_wait = False
+        # 帯域の配分（yt-dlpのratelimit）を最後に見直した時刻と、取得中のフォーマットがフラグメント形式か
+        self.ratelimit_checked = 0.0
+        self.fragmented = False
+        # 取得した動画のアーカイブID。取得済みのため何もしなかった場合はskipped
+        self.archive_ids = []
+        self.skipped = False
+        # バイト単位の進捗（映像+音声のように複数ファイルの場合は合算）
+        self.downloaded_bytes = 0
+        self.total_bytes = 0
+        self.finished_bytes = 0
+        self.expected_bytes = 0
+        # 段階ごとの所要時間（秒、METRIC_STAGES）。再試行・再開をまたいで積み上げる
+        self.timings = {}
+        self.queued_at = time.monotonic()
+        self.download_started = None
+    
+    def add_timing(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+    
+    @property
+    def estimated_total(self):
+        """既知または推定の合計サイズ。不明なら0"""
+        return max(self.total_bytes, self.expected_bytes)
+    
+    @property
+    def eta(self):
+        """残り時間（秒）。算出できなければNone"""
+        if self.speed <= 0 or self.estimated_total <= 0:
+            return None
+        return max(self.estimated_total - self.downloaded_bytes, 0) / self.speed
+
+
+def get_host(url):
+    return (urlparse(url).hostname or "").lower()
+
+
+def normalize_url(url):
+    """重複判定用にURLを正規化する（スキーム・ホストの統一、フラグメントと追跡用パラメータの除去）"""
+    parts = urlparse(url.strip())
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if parts.port:
+        host = f"{host}:{parts.port}"
+    scheme = "https" if parts.scheme in ("http", "https") else parts.scheme
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if not k.startswith("utm_"))
+    return urlunparse((scheme, host, parts.path.rstrip("/") or "/", "", urlencode(query), ""))
+
+
+def make_archive_id(info):
+    """yt-dlpのダウンロードアーカイブと同じ「抽出器 動画ID」形式のキー"""
+    extractor = info.get('extractor_key') or info.get('ie_key') or info.get('extractor')
+    if not extractor or not info.get('id'):
+        return None
+    return f"{extractor.lower()} {info['id']}"
+
+
+def is_throttle_error(message):
+    """ホスト側のレート制限（HTTP 429）によるエラーか"""
+    # URLや動画IDに含まれる「429」は無視し、HTTPのステータスだけを見る
+    match = HTTP_STATUS_PATTERN.search(message)
+    return (match is not None and match.group(1) == "429") or "too many requests" in message.lower()
+
+
+def classify_error(message):
+    """エラーメッセージからERROR_KINDSの種類を判定する"""
+    text = message.lower()
+    if "no space left" in text or "errno 28" in text or "disk full" in text or ERROR_KINDS["disk_full"] in message:
+        return "disk_full"
+    if text.startswith("ffmpeg") or "ffmpeg" in text:
+        return "ffmpeg"
+    if is_throttle_error(message):
+        return "throttled"
+    match = HTTP_STATUS_PATTERN.search(message)
+    if match:
+        status = int(match.group(1))
+        if status == 403:
+            return "forbidden"
+        if status in (404, 410):
+            return "not_found"
+        if status >= 500 or status == 408:
+            return "timeout"
+    if any(word in text for word in NETWORK_ERROR_WORDS):
+        return "timeout"
+    if any(word in text for word in UNAVAILABLE_ERROR_WORDS):
+        return "not_found"
+    if any(word in text for word in EXTRACTOR_ERROR_WORDS):
+        return "extractor"
+    return "unknown"
+
+
+def retry_delay(attempts):
+    """attempts回目の再試行までの待ち時間（秒）。上限までは倍々にし、半分〜等倍の間でばらつかせる"""
+    delay = min(RETRY_BASE_DELAY * 2 ** attempts, RETRY_MAX_DELAY)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def ytdlp_retry_sleep(n):
+    """yt-dlp内部の再試行の待ち時間（秒）。すぐに繰り返さず、短い間隔から倍々に延ばす"""
+    # yt-dlpはキーワード引数（n=何回目か、0から）で呼ぶ
+    return min(2 ** n, 30)
+
+
+def format_bytes(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.1f} {unit}" if unit != "B" else f"{num_bytes:.0f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TB"
+
+
+def format_eta(seconds):
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+
+def format_postprocess_times(times):
+    return ", ".join(f"{POSTPROCESSOR_LABELS.get(name, name)} {seconds:.1f}s" for name, seconds in times.items())
+
+
+def build_postprocess_command(ffmpeg, parts, mode, output_path):
+    """後処理の種類とffmpegのコマンドを返す。処理不要（mp4単体）なら(None, None)"""
+    # HLSは拡張子がmp4でも中身はMPEG-TSなので、詰め替えが必要
+    single = parts[0][1] if len(parts) == 1 else None
+    if (mode != "transcode" and single is not None and single.get('ext') == 'mp4'
+            and not (single.get('protocol') or '').startswith('m3u8')):
+        return None, None
+    
+    command = [ffmpeg, "-y", "-loglevel", "error"]
+    for path, _ in parts:
+        command += ["-i", path]
+    # 映像は最初の映像入り、音声は最後の音声入りのファイルから取る（bv*+baで音声が重複しないように）
+    video_index = next((i for i, (_, f) in enumerate(parts) if f.get('vcodec') != 'none'), 0)
+    audio_index = next((i for i, (_, f) in reversed(list(enumerate(parts))) if f.get('acodec') != 'none'),
+                       len(parts) - 1)
+    command += ["-map", f"{video_index}:v:0?", "-map", f"{audio_index}:a:0?"]
+    if mode == "transcode":
+        step = "VideoConvertor"
+        command += ["-c:v", "libx264", "-c:a", "aac"]
+    else:
+        step = "Merger" if len(parts) > 1 else "VideoRemuxer"
+        command += ["-c", "copy"]
+    command += ["-movflags", "+faststart", output_path]
+    return step, command
+
+
+def disk_usage(path):
+    """pathのあるディスクの使用状況（total / used / free）。取得できなければNone"""
+    try:
+        return shutil.disk_usage(path)
+    except OSError:
+        return None
+
+
+def same_device(path, other):
+    """2つのフォルダが同じドライブ（ファイルシステム）にあるか。分からなければTrue"""
+    try:
+        return os.stat(path).st_dev == os.stat(other).st_dev
+    except OSError:
+        return True
+
+
+def move_into_place(src, dst):
+    """srcをdstへ移す。途中までのファイルがdstの名前で見えないよう、別のドライブへは隣の一時ファイルにコピーしてから置き換える"""
+    try:
+        os.replace(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp_path = f"{dst}.moving"
+    try:
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    os.remove(src)
+
+
+def estimate_filesize(info):
+    """選択されたフォーマットのサイズ合計（不明なら0）"""
+    formats = info.get('requested_formats') or [info]
+    return sum(f.get('filesize') or f.get('filesize_approx') or 0 for f in formats)
+
+
+def format_stats(stats):
+    """DownloadEngine.stats()の集計値を1行の表示にする"""
+    downloaded = stats["downloaded"]
+    total = stats["total"]
+    size_str = f"{format_bytes(downloaded)} / {format_bytes(total)}" if total > 0 else format_bytes(downloaded)
+    limit = stats.get("bandwidth_limit")
+    limit_str = f"（上限 {format_bytes(limit)}/s）" if limit else ""
+    disk_str = " | 💾 容量待ち" if stats.get("disk_waiting") else ""
+    return (f"同時 {stats['active']}/{stats['limit']} | "
+            f"接続 {stats['connections']}/{stats['connection_budget']} | "
+            f"後処理 {stats['postprocessing']} | "
+            f"⬇ {format_bytes(stats['rate'])}/s{limit_str} | {size_str} | 残り {format_eta(stats['eta'])}{disk_str}")
+
+
+def load_settings():
+    try:
+        if os.path.exists(SETTINGS_FILE):
+            with open(SETTINGS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+    except (json.JSONDecodeError, IOError):
+        pass
+    return {}
+
+
+def save_settings(settings):
+    try:
+        if not os.path.exists(SETTINGS_DIR):
+            os.makedirs(SETTINGS_DIR)
+        with open(SETTINGS_FILE, "w", encoding="utf-8") as f:
+            json.dump(settings, f, ensure_ascii=False, indent=2)
+    except IOError:
+        pass
+
+
+def iter_import_urls(lines, expand=False, report=None):
+    """テキストの各行からURLを取り出す。expandならプレイリスト・チャンネルを動画ごとに展開して返す"""
+    # reportには無効な行（invalid）・展開したプレイリスト（playlist）・展開途中の失敗（error）が通知される
+    report = report or (lambda kind: None)
+    urls = _iter_url_lines(lines, report)
+    if not expand:
+        yield from urls
+        return
+    
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'quiet': True,
+        'no_warnings': True,
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        for url in urls:
+            yield from _expand_url(ydl, url, report)
+
+
+def _iter_url_lines(lines, report):
+    for line in lines:
+        url = line.strip()
+        if not url or url.startswith("#"):
+            continue
+        if not url.startswith(("http://", "https://")):
+            report("invalid")
+            continue
+        yield url
+
+
+def may_be_playlist(url):
+    """yt-dlpの抽出器から見て、プレイリスト・チャンネルの可能性があるURLか（ページは取得しない）"""
+    # yt-dlpと同じ順に、最初に対応する抽出器で判定する（汎用の抽出器は最後）
+    for ie in yt_dlp.extractor.gen_extractor_classes():
+        if ie.suitable(url):
+            # 汎用の抽出器でしか扱えないURLと、動画だけを返す抽出器のURLは展開しない
+            return ie.ie_key() != "Generic" and ie.is_single_video(url) is not True
+    return False
+
+
+def _expand_url(ydl, url, report):
+    """プレイリスト・チャンネルなら動画のURLを見つかった順に返す（それ以外はそのまま返す）"""
+    if not may_be_playlist(url):
+        # 解決はダウンロード時の1回だけにする（取り込みの段階でページを取得しない）
+        yield url
+        return
+    try:
+        # process=Falseなら、エントリはページ単位で取得されながら順に得られる
+        info = ydl.extract_info(url, download=False, process=False)
+    except Exception:
+        # 展開できないURLはダウンロード時に改めて解決する
+        yield url
+        return
+    if not info or info.get('_type') != 'playlist':
+        yield url
+        return
+    
+    report("playlist")
+    try:
+        for entry in info.get('entries') or []:
+            entry_url = entry and (entry.get('webpage_url') or entry.get('url'))
+            if entry_url:
+                yield entry_url
+    except Exception:
+        report("error")
+
+
+class ThroughputMeter:
+    """全ワーカーの受信バイト数を合算し、直近の移動窓から転送速度を求める"""
+    def __init__(self, window=THROUGHPUT_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.total_bytes = 0
+        self.samples = deque()
+    
+    def add(self, num_bytes):
+        with self.lock:
+            self.total_bytes += num_bytes
+    
+    def sample(self):
+        """現在の累計を記録し、窓内の平均速度（バイト/秒）を返す"""
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, self.total_bytes))
+            while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+                self.samples.popleft()
+            start_time, start_bytes = self.samples[0]
+            if now - start_time <= 0:
+                return 0.0
+            return (self.total_bytes - start_bytes) / (now - start_time)
+    
+    def reset(self):
+        with self.lock:
+            self.total_bytes = 0
+            self.samples.clear()
+
+
+class PipelineMetrics:
+    """段階ごとの所要時間と、結果・エラー・バイト数のカウンタを集計する（プロセスの起動から累積）"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # 段階 → [回数, 合計秒, 最大秒]
+        self.stages = {stage: [0, 0.0, 0.0] for stage in METRIC_STAGES}
+        self.counters = Counter()
+    
+    def observe(self, stage, seconds):
+        with self.lock:
+            summary = self.stages[stage]
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+    
+    def count(self, name, label="", amount=1):
+        with self.lock:
+            self.counters[(name, label)] += amount
+    
+    def snapshot(self):
+        """{"stages": {段階: {count, sum, max}}, "counters": {名前: {ラベル: 値}}}"""
+        with self.lock:
+            stages = {stage: {"count": count, "sum": total, "max": peak}
+                      for stage, (count, total, peak) in self.stages.items()}
+            counters = {}
+            for (name, label), value in self.counters.items():
+                counters.setdefault(name, {})[label] = value
+        return {"stages": stages, "counters": counters}
+
+
+class TokenBucket:
+    """トークンバケット。rate（バイト/秒）を超えて消費した分の待ち時間を返す（0は無制限）"""
+    def __init__(self, rate=0, burst=BANDWIDTH_BURST):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = rate * burst
+        self.updated = time.monotonic()
+    
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            self.tokens = min(self.tokens, rate * self.burst)
+    
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.rate * self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def consume(self, amount):
+        """amountバイト分を引き、不足分（借り）を返し終えるまでの秒数を返す"""
+        # 借りは次に消費するワーカーにも引き継がれるため、全体の速度が上限に収まる
+        with self.lock:
+            if self.rate <= 0:
+                return 0.0
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+
+class BandwidthShaper:
+    """全体とホスト毎の帯域制限。全体の上限は時間帯ごとに切り替えられる（単位はKB/s）"""
+    def __init__(self, limit=DEFAULT_BANDWIDTH_LIMIT, host_limits=None, schedule=None):
+        self.lock = threading.Lock()
+        self.limit = limit
+        self.host_limits = {host.lower(): kbps for host, kbps in (host_limits or {}).items()}
+        self.schedule = self._parse_schedule(schedule or [])
+        self.global_bucket = TokenBucket()
+        self.host_buckets = {}
+        self.checked_at = None
+        self.global_limit()
+    
+    @staticmethod
+    def _parse_schedule(schedule):
+        """[{"start": "09:00", "end": "18:00", "limit": 500}, ...] を(開始分, 終了分, KB/s)の一覧にする"""
+        windows = []
+        for window in schedule:
+            try:
+                start_h, start_m = map(int, window["start"].split(":"))
+                end_h, end_m = map(int, window["end"].split(":"))
+                windows.append((start_h * 60 + start_m, end_h * 60 + end_m, int(window["limit"])))
+            except (KeyError, ValueError, TypeError, AttributeError):
+                continue
+        return windows
+    
+    def set_limit(self, limit):
+        with self.lock:
+            self.limit = limit
+            self.checked_at = None
+        self.global_limit()
+    
+    def global_limit(self):
+        """現在の全体の上限（バイト/秒、0は無制限）。時間帯の判定は1分に1回"""
+        now = datetime.now()
+        minute = now.hour * 60 + now.minute
+        with self.lock:
+            if self.checked_at == minute:
+                return self.global_bucket.rate
+            self.checked_at = minute
+            limit = self.limit
+            for start, end, window_limit in self.schedule:
+                # 終了が開始より前の時間帯は日付をまたぐ（例: 22:00〜06:00）
+                if start <= minute < end or (end < start and (minute >= start or minute < end)):
+                    limit = window_limit
+                    break
+        self.global_bucket.set_rate(limit * 1024)
+        return limit * 1024
+    
+    def host_limit(self, host):
+        """ホストの上限（バイト/秒、0は無制限）。サブドメインにも親ドメインの設定が効く"""
+        for domain, limit in self.host_limits.items():
+            if host == domain or host.endswith("." + domain):
+                return limit * 1024
+        return 0
+    
+    def _host_bucket(self, host):
+        with self.lock:
+            bucket = self.host_buckets.get(host)
+            if bucket is None:
+                bucket = self.host_buckets[host] = TokenBucket(self.host_limit(host))
+            return bucket
+    
+    def throttle(self, host, amount):
+        """amountバイトを受信したことを記録し、上限に収めるために待つべき秒数を返す"""
+        self.global_limit()
+        wait = self.global_bucket.consume(amount)
+        if self.host_limit(host) > 0:
+            wait = max(wait, self._host_bucket(host).consume(amount))
+        return wait
+    
+    def share(self, host, active_count, host_active):
+        """実行中のタスクで均等に分けた1タスクあたりの上限（バイト/秒、0は無制限）"""
+        shares = []
+        global_limit = self.global_limit()
+        if global_limit > 0:
+            shares.append(global_limit / max(active_count, 1))
+        host_limit = self.host_limit(host)
+        if host_limit > 0:
+            shares.append(host_limit / max(host_active, 1))
+        return min(shares) if shares else 0
+
+
+class PostProcessJob:
+    """ダウンロード済みのファイル群（パスとフォーマット情報）と、後処理後の出力先"""
+    # 作業フォルダを使う場合はwork_pathに仕上げてから保存先のoutput_pathへ移す
+    def __init__(self, parts, output_path, work_path=None):
+        self.parts = parts
+        self.output_path = output_path
+        self.work_path = work_path or output_path
+
+
+class ConcurrencyController:
+    """同時ダウンロード数を管理する。自動調整時は合計転送速度とエラー率から枠を増減する"""
+    def __init__(self, max_limit, adaptive=False, per_host_limit=0,
+                 fragment_limit=DEFAULT_CONCURRENT_FRAGMENTS, connection_budget=DEFAULT_CONNECTION_BUDGET):
+        self.lock = threading.Lock()
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.per_host_limit = per_host_limit
+        self.fragment_limit = fragment_limit
+        self.connection_budget = connection_budget
+        self.connections_in_use = 0
+        self.current = min(ADAPTIVE_START_DOWNLOADS, max_limit)
+        self.host_limits = {}
+        # ホストごとに最後に429を受けた（または上限を戻した）時刻
+        self.host_throttled_at = {}
+        self.probe_rate = None
+        self.hold = 0
+        self.successes = 0
+        self.errors = 0
+        self.throttled = 0
+    
+    @property
+    def limit(self):
+        """現在の同時ダウンロード数の上限"""
+        return self.current if self.adaptive else self.max_limit
+    
+    def set_limit(self, max_limit):
+        with self.lock:
+            self.max_limit = max_limit
+            self.current = min(self.current, max_limit)
+    
+    def set_adaptive(self, adaptive):
+        with self.lock:
+            if adaptive and not self.adaptive:
+                self.current = min(ADAPTIVE_START_DOWNLOADS, self.max_limit)
+                self.probe_rate = None
+                self.hold = 0
+                # 自動調整が無効だった間の結果で最初の評価をしないように
+                self.successes = self.errors = self.throttled = 0
+            self.adaptive = adaptive
+    
+    @property
+    def needs_evaluation(self):
+        """一定間隔でevaluateを呼ぶ必要があるか（自動調整中、または429で絞ったホストがある）"""
+        return self.adaptive or bool(self.host_limits)
+    
+    def host_limit(self, host):
+        """ホストごとの上限（0は無制限）。429を返したホストは自動で絞る"""
+        with self.lock:
+            limits = [limit for limit in (self.per_host_limit, self.host_limits.get(host, 0)) if limit > 0]
+        return min(limits) if limits else 0
+    
+    def allocate_connections(self):
+        """新しいタスクに割り当てるフラグメント並列数。予算が尽きていれば0"""
+        # 1タスクあたりは予算を同時DL数で割った分までに抑え、タスク数×フラグメント数が予算を超えないようにする
+        with self.lock:
+            available = self.connection_budget - self.connections_in_use
+            if available < 1:
+                return 0
+            fair_share = max(1, self.connection_budget // max(self.limit, 1))
+            connections = max(1, min(self.fragment_limit, fair_share, available))
+            self.connections_in_use += connections
+            return connections
+    
+    def release_connections(self, connections):
+        with self.lock:
+            self.connections_in_use = max(0, self.connections_in_use - connections)
+    
+    def record_result(self, host, success, throttled=False, host_active=0):
+        with self.lock:
+            if success:
+                self.successes += 1
+            elif throttled:
+                self.throttled += 1
+                self.host_limits[host] = max(1, host_active - 1)
+                self.host_throttled_at[host] = time.monotonic()
+            else:
+                self.errors += 1
+    
+    def evaluate(self, rate, saturated):
+        """一定間隔で呼ばれ、観測した合計速度から枠を調整する。変化したらTrue"""
+        with self.lock:
+            self._relax_host_limits()
+            if not self.adaptive:
+                return False
+            previous = self.current
+            if self.throttled:
+                self.current = max(1, self.current // 2)
+                self.probe_rate = None
+                self.hold = ADAPTIVE_HOLD_ROUNDS
+            elif self.errors > self.successes:
+                self.current = max(1, self.current - 1)
+                self.probe_rate = None
+                self.hold = ADAPTIVE_HOLD_ROUNDS
+            elif self.probe_rate is not None:
+                # 直前に増やした枠で速度が伸びなければ元に戻す
+                if rate < self.probe_rate * (1 + ADAPTIVE_GAIN):
+                    self.current = max(1, self.current - 1)
+                    self.hold = ADAPTIVE_HOLD_ROUNDS
+                self.probe_rate = None
+            elif self.hold > 0:
+                self.hold -= 1
+            elif saturated and self.current < self.max_limit:
+                self.probe_rate = rate
+                self.current += 1
+            self.current = min(self.current, self.max_limit)
+            self.successes = self.errors = self.throttled = 0
+            return self.current != previous
+    
+    def _relax_host_limits(self):
+        """429のないまま一定時間が過ぎたホストの上限を1つずつ戻し、全体の上限に達したら外す（lockを保持して呼ぶ）"""
+        now = time.monotonic()
+        for host, limit in list(self.host_limits.items()):
+            if now - self.host_throttled_at.get(host, 0) < HOST_THROTTLE_RELAX:
+                continue
+            if limit + 1 >= self.max_limit:
+                del self.host_limits[host]
+                self.host_throttled_at.pop(host, None)
+            else:
+                self.host_limits[host] = limit + 1
+                self.host_throttled_at[host] = now
+
+
+class TaskQueue:
+    """優先度付きの待機キュー。ホストごとに分けて持ち、同じ優先度ではホストを順番に回して取り出す"""
+    # 削除・並べ替えではヒープから直接消さず、項目を無効にして取り出し時に読み飛ばす
+    def __init__(self):
+        self.heaps = {}
+        self.host_counts = Counter()
+        self.entries = {}
+        self.first_order = 0
+        self.last_order = 0
+        # 項目の通し番号。同じ優先度・順番で入れ直した項目が無効な項目と並んでも、タスク同士を比べないようにする
+        self.entry_count = 0
+        # ホストごとに最後に取り出した通し番号（小さいほど長く待っている）
+        self.last_served = {}
+        self.serve_count = 0
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __iter__(self):
+        return iter(self.ordered())
+    
+    def push(self, task, front=False):
+        """末尾（frontなら先頭）に追加する"""
+        if front:
+            self.first_order -= 1
+            task.queue_order = self.first_order
+        else:
+            self.last_order += 1
+            task.queue_order = self.last_order
+        self._push_entry(task)
+    
+    def restore(self, task):
+        """task.queue_orderの位置に戻す（ジャーナルからの復元・一時停止からの再開）"""
+        self.first_order = min(self.first_order, task.queue_order)
+        self.last_order = max(self.last_order, task.queue_order)
+        self._push_entry(task)
+    
+    def reprioritize(self, task, priority):
+        task.priority = priority
+        self._push_entry(task)
+    
+    def _push_entry(self, task):
+        if not self.remove(task):
+            # 並べ替えではなく新たに入ったタスク（待ち時間の計測の起点）
+            task.queued_at = time.monotonic()
+        self.entry_count += 1
+        entry = [task.priority, task.queue_order, self.entry_count, task]
+        self.entries[task.task_id] = entry
+        self.host_counts[task.host] += 1
+        heap = self.heaps.setdefault(task.host, [])
+        heapq.heappush(heap, entry)
+        if len(heap) > 2 * self.host_counts[task.host] + 64:
+            # 無効な項目が溜まったら作り直す
+            heap[:] = [entry for entry in heap if entry[-1] is not None]
+            heapq.heapify(heap)
+    
+    def remove(self, task):
+        entry = self.entries.pop(task.task_id, None)
+        if entry is None:
+            return False
+        entry[-1] = None
+        self.host_counts[task.host] -= 1
+        return True
+    
+    def clear(self):
+        self.heaps = {}
+        self.host_counts = Counter()
+        self.entries = {}
+    
+    def _head(self, host):
+        """ホストの先頭の項目。空になったホストは取り除いてNone"""
+        heap = self.heaps[host]
+        while heap and heap[0][-1] is None:
+            heapq.heappop(heap)
+        if heap:
+            return heap[0]
+        del self.heaps[host]
+        del self.host_counts[host]
+        return None
+    
+    def pop_next(self, host_available):
+        """取り出せるホストの先頭から次のタスクを選んで取り出す。なければNone"""
+        # 優先度 → 先頭へ移動したタスク → 最後に取り出してから長いホスト → 追加順 の順で比べる
+        best_key = best_host = None
+        for host in list(self.heaps):
+            entry = self._head(host)
+            if entry is None or not host_available(host):
+                continue
+            key = (entry[0], entry[1] >= 0, self.last_served.get(host, 0), entry[1])
+            if best_key is None or key < best_key:
+                best_key, best_host = key, host
+        if best_host is None:
+            return None
+        
+        task = heapq.heappop(self.heaps[best_host])[-1]
+        del self.entries[task.task_id]
+        self.host_counts[best_host] -= 1
+        self.serve_count += 1
+        self.last_served[best_host] = self.serve_count
+        return task
+    
+    def ordered(self):
+        """優先度・追加順のタスク一覧（同じ優先度のホスト間の順番は取り出し時に決まる）"""
+        return [entry[-1] for entry in sorted(self.entries.values(), key=lambda entry: entry[:2])]
+    
+    def priority_range(self):
+        """待機中のタスクの優先度の(最高, 最低)。空なら既定値"""
+        if not self.entries:
+            return DEFAULT_PRIORITY, DEFAULT_PRIORITY
+        priorities = [entry[0] for entry in self.entries.values()]
+        return min(priorities), max(priorities)
+
+
+class YoutubeDLPool:
+    """設定済みのYoutubeDLをワーカースレッド・ホストごとに使い回す（セッション・Cookie・接続を再利用する）"""
+    # YoutubeDLはスレッドセーフではないため、インスタンスは作成したスレッドだけが使う
+    def __init__(self, size=YDL_POOL_SIZE):
+        self.size = size
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.created = set()
+    
+    def acquire(self, key, factory):
+        """keyに対応する(ydl, slot)を返す。なければfactory()で作る"""
+        instances = getattr(self.local, "instances", None)
+        if instances is None:
+            instances = self.local.instances = OrderedDict()
+        item = instances.pop(key, None)
+        if item is None:
+            item = factory()
+            with self.lock:
+                self.created.add(item[0])
+        instances[key] = item
+        while len(instances) > self.size:
+            # 最も長く使われていないものを閉じる
+            _, (ydl, _) = instances.popitem(last=False)
+            self._close(ydl)
+        return item
+    
+    def discard(self, key):
+        """このスレッドのインスタンスを捨てる（状態が壊れている可能性がある場合）"""
+        instances = getattr(self.local, "instances", None)
+        item = instances.pop(key, None) if instances else None
+        if item is not None:
+            self._close(item[0])
+    
+    def close_all(self):
+        """全スレッドのインスタンスを閉じる（ワーカースレッドの終了後に呼ぶ）"""
+        with self.lock:
+            created, self.created = self.created, set()
+        for ydl in created:
+            ydl.close()
+        self.local = threading.local()
+    
+    def _close(self, ydl):
+        with self.lock:
+            self.created.discard(ydl)
+        ydl.close()
+
+
+class ProgressBoard:
+    """ワーカースレッドが書き込むタスクごとの最新状態。UI側は変更分だけを取り出す"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.dirty = set()
+        self.event_count = 0
+        self.applied_count = 0
+    
+    def update(self, task_id, **fields):
+        """最新状態を上書きする（UIへの反映は次の更新ティックでまとめて行う）"""
+        with self.lock:
+            self.snapshots.setdefault(task_id, {}).update(fields)
+            self.dirty.add(task_id)
+            self.event_count += 1
+    
+    def drain(self):
+        """前回以降に変化したタスクの状態を返す"""
+        with self.lock:
+            changed = {task_id: dict(self.snapshots[task_id]) for task_id in self.dirty if task_id in self.snapshots}
+            self.dirty = set()
+            self.applied_count += len(changed)
+        return changed
+    
+    def get(self, task_id):
+        with self.lock:
+            return dict(self.snapshots.get(task_id, {}))
+    
+    def discard(self, task_id):
+        with self.lock:
+            self.snapshots.pop(task_id, None)
+            self.dirty.discard(task_id)
+    
+    def reset_counters(self):
+        with self.lock:
+            self.event_count = 0
+            self.applied_count = 0
+    
+    @property
+    def coalesced_count(self):
+        """UIに反映されずに上書きされたイベント数"""
+        return self.event_count - self.applied_count
+
+
+class QueueJournal:
+    """キューの状態変化を追記するジャーナル。起動時に再生して未完了のタスクを復元する"""
+    FINISHED_STATES = ("done", "removed")
+    
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+    
+    def record(self, task, state):
+        self.record_many([task], state)
+    
+    def record_many(self, tasks, state):
+        """状態変化を追記し、クラッシュしても失われないようfsyncする"""
+        if not tasks:
+            return
+        lines = "".join(
+            json.dumps({"id": t.task_id, "url": t.url, "title": t.title, "state": state,
+                        "priority": t.priority, "order": t.queue_order}, ensure_ascii=False) + "\n"
+            for t in tasks
+        )
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except IOError:
+                pass
+    
+    def restore(self):
+        """未完了のタスクの最終状態を追加順に返し、ジャーナルをそれだけに詰め直す"""
+        entries = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 書き込み途中で終了した最終行
+                        continue
+                    if entry.get("state") in self.FINISHED_STATES:
+                        entries.pop(entry.get("id"), None)
+                    else:
+                        entries[entry.get("id")] = entry
+        except IOError:
+            return []
+        
+        live = list(entries.values())
+        tmp_path = f"{self.path}.tmp"
+        with self.lock:
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for entry in live:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except IOError:
+                pass
+        return live
+
+
+class HistoryStore:
+    """履歴をJSON Linesへ追記する。書き込みは専用スレッドでまとめて行い、fsyncはバッチごとに1回"""
+    def __init__(self, path, flush_interval=HISTORY_FLUSH_INTERVAL, on_flush=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        # 書き込みのたびに(件数, 秒)で呼ばれる
+        self.on_flush = on_flush
+        self.requests = queue.Queue()
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+    
+    def append(self, entry):
+        """1件追記する（呼び出し側はディスクI/Oを待たない）"""
+        self.requests.put(("append", entry))
+    
+    def clear(self):
+        self.requests.put(("clear", None))
+    
+    def close(self, timeout=5.0):
+        """未書き込みの履歴を書き出して書き込みスレッドを止める"""
+        done = threading.Event()
+        self.requests.put(("close", done))
+        done.wait(timeout)
+    
+    def migrate_legacy(self, legacy_path):
+        """旧形式（新しい順のJSON配列）の履歴を取り込み、元のファイルは.bakに退避する"""
+        if not os.path.exists(legacy_path) or os.path.exists(self.path):
+            return
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                for entry in reversed(entries):
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(legacy_path, f"{legacy_path}.bak")
+        except (json.JSONDecodeError, IOError):
+            pass
+    
+    def iter_entries(self):
+        """古い順にすべての履歴を返す"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except IOError:
+            return
+    
+    def read_page(self, limit, end=None):
+        """ファイル末尾（またはend位置）から新しい順に最大limit件読み、次のページの終端位置と返す"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell() if end is None else end
+                start = end
+                buffer = b""
+                # 先頭の行が途中で切れている可能性があるため、limit+1行分の改行が見つかるまで遡る
+                while start > 0 and buffer.count(b"\n") <= limit:
+                    size = min(HISTORY_READ_BLOCK, start)
+                    start -= size
+                    f.seek(start)
+                    buffer = f.read(size) + buffer
+        except IOError:
+            return [], 0
+        
+        if start > 0:
+            head_end = buffer.find(b"\n") + 1
+            start += head_end
+            buffer = buffer[head_end:]
+        
+        entries = []
+        pos = len(buffer)
+        while pos > 0 and len(entries) < limit:
+            line_start = buffer.rfind(b"\n", 0, pos - 1) + 1
+            line = buffer[line_start:pos].strip()
+            pos = line_start
+            if line:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass
+        return entries, start + pos
+    
+    def _writer_loop(self):
+        while True:
+            batch = [self.requests.get()]
+            # 最初の1件から一定時間、または終了要求までに届いた分をまとめて書く
+            deadline = time.monotonic() + self.flush_interval
+            while batch[-1][0] != "close":
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+            if batch[-1][0] == "close":
+                batch[-1][1].set()
+                return
+    
+    def _write_batch(self, batch):
+        lines = []
+        truncate = False
+        for kind, payload in batch:
+            if kind == "append":
+                lines.append(json.dumps(payload, ensure_ascii=False) + "\n")
+            elif kind == "clear":
+                lines = []
+                truncate = True
+        if not lines and not truncate:
+            return
+        started = time.monotonic()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "w" if truncate else "a", encoding="utf-8") as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        except IOError:
+            return
+        if self.on_flush is not None:
+            self.on_flush(len(lines), time.monotonic() - started)
+
+
+class MetricsLog:
+    """計測値をJSON Linesへ追記する。書き込みは専用スレッドで行い、合間に一定間隔で全体の集計値も記録する"""
+    def __init__(self, path, snapshot=None, interval=METRICS_SNAPSHOT_INTERVAL):
+        self.path = path
+        # 集計値を返す関数（記録しない場合はNoneを返す）
+        self.snapshot = snapshot
+        self.interval = interval
+        self.requests = queue.Queue()
+        self.writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer.start()
+    
+    def write(self, record):
+        self.requests.put(record)
+    
+    def close(self, timeout=5.0):
+        done = threading.Event()
+        self.requests.put(done)
+        done.wait(timeout)
+    
+    def _writer_loop(self):
+        next_snapshot = time.monotonic() + self.interval
+        while True:
+            try:
+                item = self.requests.get(timeout=max(next_snapshot - time.monotonic(), 0))
+            except queue.Empty:
+                item = self.snapshot() if self.snapshot else None
+                next_snapshot = time.monotonic() + self.interval
+            # 溜まっている分もまとめて書く
+            batch = [item]
+            while not isinstance(batch[-1], threading.Event):
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            records = [record for record in batch if isinstance(record, dict)]
+            if records:
+                try:
+                    os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+                except IOError:
+                    pass
+            if isinstance(batch[-1], threading.Event):
+                batch[-1].set()
+                return
+
+
+class DownloadIndex:
+    """正規化URLとアーカイブIDで「取得済み・キュー済み」をO(1)で判定する索引"""
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.lock = threading.Lock()
+        self.downloaded_urls = set()
+        self.downloaded_ids = set()
+        self.queued_urls = set()
+    
+    def load(self, history_store):
+        """ダウンロードアーカイブと履歴から取得済みの索引を作る（起動時に別スレッドで呼ぶ）"""
+        ids = set()
+        try:
+            with open(self.archive_path, "r", encoding="utf-8") as f:
+                ids = {line.strip() for line in f if line.strip()}
+        except IOError:
+            pass
+        urls = {normalize_url(entry["url"]) for entry in history_store.iter_entries()
+                if entry.get("status") == "✅" and entry.get("url")}
+        with self.lock:
+            self.downloaded_ids |= ids
+            self.downloaded_urls |= urls
+    
+    def is_downloaded_url(self, url):
+        with self.lock:
+            return normalize_url(url) in self.downloaded_urls
+    
+    def is_downloaded_id(self, archive_id):
+        with self.lock:
+            return archive_id in self.downloaded_ids
+    
+    def is_queued(self, url):
+        with self.lock:
+            return normalize_url(url) in self.queued_urls
+    
+    def add_queued(self, url):
+        with self.lock:
+            self.queued_urls.add(normalize_url(url))
+    
+    def remove_queued(self, url):
+        with self.lock:
+            self.queued_urls.discard(normalize_url(url))
+    
+    def record_download(self, url, archive_ids):
+        """取得済みとして登録し、新しいアーカイブIDをアーカイブファイルに追記する"""
+        with self.lock:
+            self.downloaded_urls.add(normalize_url(url))
+            new_ids = [archive_id for archive_id in dict.fromkeys(archive_ids) if archive_id not in self.downloaded_ids]
+            self.downloaded_ids.update(new_ids)
+            if not new_ids:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.archive_path), exist_ok=True)
+                with open(self.archive_path, "a", encoding="utf-8") as f:
+                    f.writelines(f"{archive_id}\n" for archive_id in new_ids)
+            except IOError:
+                pass
+
+
+class MetadataCache:
+    """extract_infoの結果をURLごとにディスクへ保存するTTL付きキャッシュ"""
+    def __init__(self, cache_dir, ttl_minutes):
+        self.cache_dir = cache_dir
+        self.ttl_minutes = ttl_minutes
+    
+    @property
+    def enabled(self):
+        return self.ttl_minutes > 0
+    
+    def _path(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.json")
+    
+    def _is_expired(self, entry):
+        return time.time() - entry.get("saved_at", 0) > self.ttl_minutes * 60
+    
+    def get(self, url):
+        """有効期限内のキャッシュがあれば情報辞書を返す"""
+        if not self.enabled:
+            return None
+        try:
+            with open(self._path(url), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return None
+        if entry.get("url") != url or self._is_expired(entry):
+            self.invalidate(url)
+            return None
+        return entry.get("info")
+    
+    def put(self, url, info):
+        """情報辞書を保存する（一時ファイル経由で置き換え）"""
+        if not self.enabled:
+            return
+        path = self._path(url)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"url": url, "saved_at": time.time(), "info": info}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (TypeError, ValueError, IOError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    
+    def invalidate(self, url):
+        try:
+            os.remove(self._path(url))
+        except OSError:
+            pass
+    
+    def prune(self):
+        """期限切れのキャッシュファイルを削除する"""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            try:
+                if not self.enabled or time.time() - os.path.getmtime(path) > self.ttl_minutes * 60:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+
+
+class DownloadEngine:
+    """キュー・スケジューリング・ダウンロード・後処理・履歴をまとめたエンジン（GUI・CLIで共用）"""
+    def __init__(self, settings, journal_path=QUEUE_JOURNAL_FILE):
+        self.settings = settings
+        
+        # 後処理モード
+        self.post_processing = settings.get("post_processing", DEFAULT_POST_PROCESSING)
+        if self.post_processing not in POST_PROCESSING_MODES:
+            self.post_processing = DEFAULT_POST_PROCESSING
+        
+        # 同時ダウンロード数・ホスト毎上限・接続数
+        self.concurrency = ConcurrencyController(settings.get("concurrent_downloads", DEFAULT_CONCURRENT_DOWNLOADS),
+                                                 settings.get("adaptive_concurrency", False),
+                                                 settings.get("per_host_limit", 0),
+                                                 settings.get("concurrent_fragments", DEFAULT_CONCURRENT_FRAGMENTS),
+                                                 settings.get("connection_budget", DEFAULT_CONNECTION_BUDGET))
+        
+        # 帯域制限（全体・ホスト毎・時間帯）
+        self.bandwidth = BandwidthShaper(settings.get("bandwidth_limit", DEFAULT_BANDWIDTH_LIMIT),
+                                         settings.get("host_bandwidth_limits"), settings.get("bandwidth_schedule"))
+        
+        # メタデータキャッシュ
+        self.metadata_cache = MetadataCache(METADATA_CACHE_DIR,
+                                            settings.get("metadata_cache_ttl", DEFAULT_METADATA_CACHE_TTL))
+        self.metadata_cache.prune()
+        
+        # ダウンロード状態
+        self.is_running = False
+        # Trueの間はキューが空になってもスケジューラを終了せず、追加を待つ
+        self.keep_alive = False
+        # Trueなら、空き容量が足りず空きを作るタスクもない時に、容量待ちにせず失敗にする（追加を待たない場合のみ）
+        self.fail_on_disk_shortfall = False
+        self.cancel_all_requested = False
+        self.idle = threading.Event()
+        self.idle.set()
+        self.download_queue = TaskQueue()
+        self.active_tasks = {}
+        self.postprocessing_tasks = {}
+        self.paused_tasks = {}
+        # 一時的なエラーで再試行を待つタスク。ワーカーは使わず、時刻順のヒープでスケジューラが起こす
+        self.retry_tasks = {}
+        self.retry_heap = []
+        self.completed_count = 0
+        self.total_count = 0
+        self.completed_bytes = 0
+        self.host_active = Counter()
+        self.task_id_counter = 0
+        self.queue_lock = threading.RLock()
+        self.queue_cond = threading.Condition(self.queue_lock)
+        self.executor = None
+        self.post_executor = None
+        # ワーカースレッド・ホストごとに使い回すYoutubeDL
+        self.ydl_pool = YoutubeDLPool()
+        
+        # 状態変化の通知先（ワーカースレッドからも呼ばれる）
+        self.listeners = []
+        
+        # ワーカー → 表示側の進捗受け渡し
+        self.progress_board = ProgressBoard()
+        self.throughput = ThroughputMeter()
+        
+        # 計測値（APIの/metricsで公開）と、設定で有効にした場合の計測ログ
+        self.metrics = PipelineMetrics()
+        metrics_log = settings.get("metrics_log", False)
+        self.metrics_log = None
+        if metrics_log:
+            self.metrics_log = MetricsLog(metrics_log if isinstance(metrics_log, str) else METRICS_LOG_FILE,
+                                          self._metrics_snapshot)
+        
+        # キューの永続化
+        self.queue_journal = QueueJournal(journal_path)
+        
+        # 履歴（追記専用のストア）
+        self.history_store = HistoryStore(HISTORY_FILE,
+                                          on_flush=lambda count, seconds: self.metrics.observe("history_write", seconds))
+        self.history_store.migrate_legacy(LEGACY_HISTORY_FILE)
+        
+        # 作業フォルダ（空なら保存先に直接書く）と、確保しておく空き容量
+        self.staging_dir = settings.get("staging_dir", "")
+        self.min_free_space = settings.get("min_free_space", DEFAULT_MIN_FREE_SPACE) * 1024 * 1024
+        # 空き容量が足りずにタスクを待たせている場合の(フォルダ, 空き, 必要量)
+        self.disk_shortfall = None
+        # 書き込み中の保存先のパス → タスクID（同じタイトルの動画が同時に同じ名前へ書かないように）
+        self.claimed_outputs = {}
+        
+        # 取得済み・キュー済みの索引（過去の実行分はバックグラウンドで読み込む）
+        self.skip_existing = settings.get("skip_existing", True)
+        self.download_index = DownloadIndex(DOWNLOAD_ARCHIVE_FILE)
+        threading.Thread(target=self.download_index.load, args=(self.history_store,), daemon=True).start()
+    
+    def add_listener(self, listener):
+        """状態変化の通知先を登録する。listener(イベント名, 内容の辞書)の形で呼ばれる"""
+        # イベント: queued / removed / reordered / paused / resumed / status / task_finished / finished
+        self.listeners.append(listener)
+    
+    def _emit(self, event, **data):
+        for listener in self.listeners:
+            listener(event, data)
+    
+    def close(self):
+        """未書き込みの履歴と計測ログを書き出す"""
+        self.history_store.close()
+        if self.metrics_log is not None:
+            self.metrics_log.close()
+    
+    def set_concurrency(self, limit, per_host_limit, fragment_limit, connection_budget):
+        """同時DL数・ホスト毎上限・接続数を変更し、実行中のバッチにも即座に反映する"""
+        with self.queue_cond:
+            self.concurrency.set_limit(limit)
+            self.concurrency.per_host_limit = per_host_limit
+            self.concurrency.fragment_limit = fragment_limit
+            self.concurrency.connection_budget = connection_budget
+            self.queue_cond.notify_all()
+    
+    def set_bandwidth_limit(self, limit):
+        """全体の帯域上限（KB/s）を変更する。実行中のタスクの配分は次の進捗通知で見直す"""
+        self.bandwidth.set_limit(limit)
+        for task in list(self.active_tasks.values()):
+            task.ratelimit_checked = 0.0
+    
+    def set_adaptive(self, adaptive):
+        with self.queue_cond:
+            self.concurrency.set_adaptive(adaptive)
+            self.queue_cond.notify_all()
+    
+    def restore_queue(self):
+        """ジャーナルから未完了のタスクを復元する（途中だったものは中断扱い、一時停止中のものはそのまま）"""
+        restored = []
+        for entry in self.queue_journal.restore():
+            task = DownloadTask(entry["url"], entry["id"])
+            task.title = entry.get("title", "")
+            task.resumed = entry.get("state") in ("active", "paused")
+            task.pause_requested = entry.get("state") == "paused"
+            task.priority = entry.get("priority", DEFAULT_PRIORITY)
+            task.queue_order = entry.get("order", 0)
+            restored.append(task)
+        if not restored:
+            return restored
+        
+        with self.queue_lock:
+            for task in restored:
+                if task.pause_requested:
+                    self.paused_tasks[task.task_id] = task
+                else:
+                    self.download_queue.restore(task)
+                self.download_index.add_queued(task.url)
+            self.task_id_counter = max(self.task_id_counter, max(task.task_id for task in restored))
+        self._emit("queued", tasks=restored)
+        self._emit("reordered", task_ids=[task.task_id for task in self.download_queue])
+        self._emit("status", message=f"📋 前回のキューを復元: {len(restored)}件")
+        return restored
+    
+    def enqueue(self, urls):
+        """URLをまとめてキューに追加する。(追加したタスク, 重複数, スキップ数)を返す"""
+        added = []
+        duplicates = 0
+        skipped = 0
+        with self.queue_lock:
+            for url in urls:
+                if self.download_index.is_queued(url):
+                    duplicates += 1
+                    continue
+                if self.skip_existing and self.download_index.is_downloaded_url(url):
+                    skipped += 1
+                    continue
+                self.task_id_counter += 1
+                task = DownloadTask(url, self.task_id_counter)
+                self.download_queue.push(task)
+                self.download_index.add_queued(url)
+                added.append(task)
+            if added:
+                if self.is_running:
+                    self.total_count += len(added)
+                self.queue_cond.notify_all()
+        
+        if added:
+            self.queue_journal.record_many(added, "pending")
+            self._emit("queued", tasks=added)
+            if self.download_queue.priority_range()[1] > DEFAULT_PRIORITY:
+                # 優先度の低いタスクより前に並ぶ
+                self._emit("reordered", task_ids=[task.task_id for task in self.download_queue])
+        return added, duplicates, skipped
+    
+    def remove(self, task_ids):
+        """待機中・再試行待ち・一時停止中のタスクをキューから外す（実行中のものはそのまま）。外したタスクを返す"""
+        task_ids = set(task_ids)
+        with self.queue_lock:
+            removed = [task for task in self.download_queue if task.task_id in task_ids]
+            for task in removed:
+                self.download_queue.remove(task)
+            removed += [self.paused_tasks.pop(task_id) for task_id in task_ids if task_id in self.paused_tasks]
+            removed += [self.retry_tasks.pop(task_id) for task_id in task_ids if task_id in self.retry_tasks]
+            for task in removed:
+                self.download_index.remove_queued(task.url)
+        self._forget(removed)
+        return removed
+    
+    def clear_pending(self):
+        """待機中・再試行待ち・一時停止中のタスクをすべてキューから外す"""
+        with self.queue_lock:
+            removed = list(self.download_queue) + list(self.retry_tasks.values()) + list(self.paused_tasks.values())
+            self.download_queue.clear()
+            self.retry_tasks.clear()
+            self.retry_heap = []
+            self.paused_tasks.clear()
+            for task in removed:
+                self.download_index.remove_queued(task.url)
+        self._forget(removed)
+        return removed
+    
+    def set_priority(self, task_ids, priority):
+        """待機中のタスクの優先度を変える"""
+        task_ids = set(task_ids)
+        with self.queue_lock:
+            changed = [task for task in self.download_queue if task.task_id in task_ids]
+            for task in changed:
+                self.download_queue.reprioritize(task, priority)
+            # 一時停止中・再試行待ちのタスクはキューに戻る時に反映される
+            for task_id in task_ids & set(self.paused_tasks):
+                self.paused_tasks[task_id].priority = priority
+                changed.append(self.paused_tasks[task_id])
+            for task_id in task_ids & set(self.retry_tasks):
+                self.retry_tasks[task_id].priority = priority
+        self._reordered(changed)
+    
+    def move(self, task_ids, front=True):
+        """待機中のタスクをキューの先頭（frontでなければ末尾）へ移す。選択した順番は保つ"""
+        task_ids = set(task_ids)
+        with self.queue_lock:
+            moved = [task for task in self.download_queue if task.task_id in task_ids]
+            highest, lowest = self.download_queue.priority_range()
+            # 先頭へは逆順に積むことで、選択したタスク同士の順番を保つ
+            for task in (reversed(moved) if front else moved):
+                task.priority = highest if front else lowest
+                self.download_queue.push(task, front=front)
+        self._reordered(moved)
+    
+    def _reordered(self, tasks):
+        if not tasks:
+            return
+        self.queue_journal.record_many([task for task in tasks if not task.pause_requested], "pending")
+        self.queue_journal.record_many([task for task in tasks if task.pause_requested], "paused")
+        self._emit("reordered", task_ids=[task.task_id for task in self.download_queue])
+    
+    def pause(self, task_ids):
+        """一時停止する。実行中のタスクは.partを残して止め、待機中のタスクはキューから外して保留する"""
+        with self.queue_cond:
+            parked = []
+            for task_id in task_ids:
+                task = self.active_tasks.get(task_id)
+                if task is not None:
+                    # 完了コールバックで一時停止中に移る
+                    task.pause_requested = True
+                    task.cancel_requested = True
+                    continue
+                task = self.retry_tasks.pop(task_id, None)
+                if task is None:
+                    task = next((t for t in self.download_queue if t.task_id == task_id), None)
+                    if task is not None:
+                        self.download_queue.remove(task)
+                if task is not None:
+                    task.pause_requested = True
+                    self.paused_tasks[task_id] = task
+                    parked.append(task)
+            self.queue_cond.notify_all()
+        for task in parked:
+            self._park_task(task)
+    
+    def resume(self, task_ids):
+        """一時停止中のタスクを元の位置へ戻す"""
+        with self.queue_cond:
+            resumed = [self.paused_tasks.pop(task_id) for task_id in task_ids if task_id in self.paused_tasks]
+            for task in resumed:
+                task.pause_requested = False
+                task.cancel_requested = False
+                task.error = ""
+                self.download_queue.restore(task)
+                if self.is_running:
+                    self.total_count += 1
+            self.queue_cond.notify_all()
+        if not resumed:
+            return
+        self.queue_journal.record_many(resumed, "pending")
+        self._emit("resumed", task_ids=[task.task_id for task in resumed])
+        self._emit("reordered", task_ids=[task.task_id for task in self.download_queue])
+    
+    def _park_task(self, task):
+        self.progress_board.discard(task.task_id)
+        self.queue_journal.record(task, "paused")
+        self._emit("paused", task_ids=[task.task_id])
+    
+    def _forget(self, tasks):
+        if not tasks:
+            return
+        self._release_output_names(tasks)
+        self.queue_journal.record_many(tasks, "removed")
+        self._emit("removed", task_ids=[task.task_id for task in tasks])
+    
+    def _release_output_names(self, tasks):
+        """タスクが確保していた保存先のファイル名を、他のタスクが使えるよう手放す"""
+        task_ids = {task.task_id for task in tasks}
+        with self.queue_lock:
+            self.claimed_outputs = {path: owner for path, owner in self.claimed_outputs.items()
+                                    if owner not in task_ids}
+    
+    def list_tasks(self):
+        """キュー内のタスクを(状態, タスク)の組で返す。状態はpending / retrying / active / postprocessing / paused"""
+        with self.queue_lock:
+            return ([("active", task) for task in self.active_tasks.values()] +
+                    [("postprocessing", task) for task in self.postprocessing_tasks.values()] +
+                    [("retrying", task) for task in self.retry_tasks.values()] +
+                    [("paused", task) for task in self.paused_tasks.values()] +
+                    [("pending", task) for task in self.download_queue])
+    
+    def get_task(self, task_id):
+        """(状態, タスク)を返す。キューにない場合は(None, None)"""
+        for state, task in self.list_tasks():
+            if task.task_id == task_id:
+                return state, task
+        return None, None
+    
+    def cancel(self, task_id):
+        """1件だけ中止する。待機中・一時停止中ならキューから外し、実行中なら中止を要求する。対象がなければFalse"""
+        with self.queue_cond:
+            task = self.active_tasks.get(task_id) or self.postprocessing_tasks.get(task_id)
+            if task is not None:
+                task.cancel_requested = True
+                task.pause_requested = False
+                process = task.ffmpeg_process
+                if process is not None:
+                    process.terminate()
+                return True
+        return bool(self.remove([task_id]))
+    
+    def clear_history(self):
+        self.history_store.clear()
+    
+    def retry_failed(self):
+        """履歴で最後の結果が失敗（❌）のURLをまとめてキューへ戻す。(追加したタスク, 重複数, スキップ数)を返す"""
+        latest = {}
+        for entry in self.history_store.iter_entries():
+            latest[entry.get("url")] = entry.get("status")
+        urls = [url for url, status in latest.items() if url and status == "❌"]
+        result = self.enqueue(urls)
+        self._emit("status", message=f"🔁 失敗したURLを再投入: {len(result[0])}件")
+        return result
+    
+    def start(self, save_dir, keep_alive=False, fail_on_disk_shortfall=False):
+        """スケジューラを別スレッドで起動する。起動しなかった場合はFalse"""
+        with self.queue_lock:
+            is_empty = not self.download_queue
+        if is_empty and not keep_alive:
+            self._emit("status", message="⚠ キューが空です")
+            return False
+        
+        if self.is_running:
+            return False
+        
+        if not os.path.isdir(save_dir):
+            self._emit("status", message="❌ 保存先が存在しません")
+            return False
+        if self.staging_dir:
+            try:
+                os.makedirs(self.staging_dir, exist_ok=True)
+            except OSError as e:
+                self._emit("status", message=f"❌ 作業フォルダを作成できません: {e}")
+                return False
+        
+        self.cancel_all_requested = False
+        self.keep_alive = keep_alive
+        self.fail_on_disk_shortfall = fail_on_disk_shortfall
+        self.completed_count = 0
+        self.completed_bytes = 0
+        with self.queue_lock:
+            self.total_count = len(self.download_queue)
+            self.is_running = True
+        self.idle.clear()
+        self.progress_board.reset_counters()
+        self.throughput.reset()
+        
+        thread = threading.Thread(target=self._process_queue, args=(save_dir,), daemon=True)
+        thread.start()
+        return True
+    
+    def stop_when_idle(self):
+        """追加待ちをやめ、キューが空になった時点でスケジューラを終了させる"""
+        with self.queue_cond:
+            self.keep_alive = False
+            self.queue_cond.notify_all()
+    
+    def wait(self, timeout=None):
+        """スケジューラの終了を待つ。終了していればTrue"""
+        return self.idle.wait(timeout)
+    
+    def cancel_all(self):
+        with self.queue_cond:
+            self.cancel_all_requested = True
+            for task in list(self.active_tasks.values()) + list(self.postprocessing_tasks.values()):
+                task.cancel_requested = True
+                process = task.ffmpeg_process
+                if process is not None:
+                    process.terminate()
+            self.queue_cond.notify_all()
+        self._emit("status", message="⏹ 中止中...")
+    
+    def stats(self):
+        """バイト数で重み付けした全体進捗（0〜1）と、合計速度・残り時間などの集計値を返す"""
+        with self.queue_lock:
+            active = list(self.active_tasks.values())
+            pending_count = len(self.download_queue) + len(self.retry_tasks)
+            retrying_count = len(self.retry_tasks)
+            postprocessing_count = len(self.postprocessing_tasks)
+        
+        downloaded = self.completed_bytes + sum(task.downloaded_bytes for task in active)
+        known_totals = [task.estimated_total for task in active if task.estimated_total > 0]
+        known_count = self.completed_count + len(known_totals)
+        known_bytes = self.completed_bytes + sum(known_totals)
+        
+        if known_count > 0 and known_bytes > 0:
+            # サイズ不明のタスクは既知タスクの平均サイズで見積もる
+            average = known_bytes / known_count
+            unknown_count = len(active) - len(known_totals) + pending_count
+            total = known_bytes + average * unknown_count
+            overall = downloaded / total if total > 0 else 0
+        elif self.total_count > 0:
+            total = 0
+            overall = (self.completed_count + sum(task.progress for task in active) / 100) / self.total_count
+        else:
+            total = 0
+            overall = 0
+        
+        rate = self.throughput.sample()
+        remaining = max(total - downloaded, 0)
+        return {
+            "active": len(active),
+            "pending": pending_count,
+            "retrying": retrying_count,
+            "postprocessing": postprocessing_count,
+            "limit": self.concurrency.limit,
+            "connections": self.concurrency.connections_in_use,
+            "connection_budget": self.concurrency.connection_budget,
+            "downloaded": downloaded,
+            "total": total,
+            "overall": min(overall, 1.0),
+            "rate": rate,
+            "bandwidth_limit": self.bandwidth.global_limit(),
+            "disk_waiting": self.disk_shortfall is not None,
+            "eta": remaining / rate if rate > 0 and total > 0 else None,
+        }
+    
+    def _process_queue(self, save_dir):
+        """空きスロットができ次第、次のURLを投入するスケジューラ"""
+        # 枠は実行中にも増減するため、スレッドは上限分まで確保しておく（生成は必要になった時）
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS)
+        # 結合・変換はCPU処理なので別のプールで行い、その間にダウンロード枠を次のURLへ回す
+        self.post_executor = ThreadPoolExecutor(max_workers=POST_PROCESS_WORKERS)
+        next_evaluation = time.monotonic() + ADAPTIVE_INTERVAL
+        
+        # 通知とタスクの後始末はqueue_lockを放してから行う（GUIのリスナーはUIスレッドを待つため）
+        notices = []
+        try:
+            while True:
+                for notice in notices:
+                    notice()
+                notices = []
+                with self.queue_cond:
+                    if self.cancel_all_requested:
+                        break
+                    self._release_due_retries()
+                    while len(self.active_tasks) < self.concurrency.limit and self.download_queue:
+                        # 接続数の予算が尽きていれば、他のタスクの完了を待つ
+                        connections = self.concurrency.allocate_connections()
+                        if connections == 0:
+                            break
+                        task = self._pop_dispatchable_task()
+                        if task is None:
+                            self.concurrency.release_connections(connections)
+                            break
+                        shortfall = self._space_shortfall(task, save_dir)
+                        if shortfall is not None:
+                            self.concurrency.release_connections(connections)
+                            if (self.fail_on_disk_shortfall and not self.keep_alive
+                                    and not self.active_tasks and not self.postprocessing_tasks):
+                                # 空きを作るタスクがなく、利用者が空けるのを待つこともないなら失敗にする
+                                self._fail_for_disk_space(task, shortfall, notices)
+                                continue
+                            # 失敗にはせず、実行中のタスクが終わるか空きができるまで先頭で待たせる
+                            self._hold_for_disk_space(task, shortfall, notices)
+                            break
+                        self.disk_shortfall = None
+                        task.disk_wait = False
+                        task.connections = connections
+                        queue_wait = time.monotonic() - task.queued_at
+                        task.add_timing("queue_wait", queue_wait)
+                        self.metrics.observe("queue_wait", queue_wait)
+                        self.active_tasks[task.task_id] = task
+                        self.host_active[task.host] += 1
+                        self.queue_journal.record(task, "active")
+                        
+                        self.progress_board.update(task.task_id, status="再開中" if task.resumed else "DL中", progress=0)
+                        future = self.executor.submit(self._download_video, task, save_dir)
+                        future.add_done_callback(lambda f, t=task: self._on_download_done(t, f))
+                    
+                    if notices:
+                        # 通知してから、待つ前にもう一度取り出しを試みる
+                        continue
+                    
+                    # 後処理中のタスクも、容量不足で容量待ちとしてキューへ戻ることがあるので終わるまで待つ
+                    if (not self.download_queue and not self.active_tasks and not self.postprocessing_tasks
+                            and not self.retry_tasks and not self.keep_alive):
+                        break
+                    
+                    now = time.monotonic()
+                    if self.concurrency.needs_evaluation and now >= next_evaluation:
+                        saturated = len(self.active_tasks) >= self.concurrency.limit and bool(self.download_queue)
+                        self.concurrency.evaluate(self.throughput.sample(), saturated)
+                        next_evaluation = now + ADAPTIVE_INTERVAL
+                        continue
+                    
+                    # タスク完了・キュー追加・設定変更・中止のいずれか、または自動調整・再試行・空き容量の確認の時刻に起こされる
+                    deadlines = [deadline for deadline in (next_evaluation if self.concurrency.needs_evaluation else None,
+                                                           self._next_retry_time(),
+                                                           now + DISK_RECHECK_INTERVAL if self.disk_shortfall else None)
+                                 if deadline is not None]
+                    self.queue_cond.wait(min(deadlines) - now if deadlines else None)
+            
+        finally:
+            # ダウンロード側を先に止める（完了コールバックが後処理を投入し終えるまで待つ）
+            self.executor.shutdown(wait=True)
+            self.executor = None
+            self.post_executor.shutdown(wait=True)
+            self.post_executor = None
+            self.ydl_pool.close_all()
+            self.disk_shortfall = None
+            with self.queue_lock:
+                # 再試行待ちのタスクは待機中としてキューに残す（次回の開始時にすぐ取り出す）
+                for task in self.retry_tasks.values():
+                    task.error = ""
+                    self.download_queue.restore(task)
+                self.retry_tasks.clear()
+                self.retry_heap = []
+            cancelled = self.cancel_all_requested
+            result = "✅ 完了" if not cancelled else "⏹ 中止"
+            board = self.progress_board
+            summary = f"{result}（進捗イベント {board.event_count}件 / 集約 {board.coalesced_count}件）"
+            with self.queue_lock:
+                self.is_running = False
+                self.keep_alive = False
+            self.cancel_all_requested = False
+            self._emit("finished", cancelled=cancelled, summary=summary)
+            self.idle.set()
+    
+    def _next_retry_time(self):
+        """最も早く再試行するタスクの時刻。なければNone"""
+        heap = self.retry_heap
+        # 一時停止・削除されたタスクの項目は読み飛ばす
+        while heap and (heap[0][1] not in self.retry_tasks or self.retry_tasks[heap[0][1]].retry_at != heap[0][0]):
+            heapq.heappop(heap)
+        return heap[0][0] if heap else None
+    
+    def _release_due_retries(self):
+        """再試行の時刻になったタスクを元の位置でキューへ戻す"""
+        now = time.monotonic()
+        while True:
+            retry_at = self._next_retry_time()
+            if retry_at is None or retry_at > now:
+                return
+            _, task_id = heapq.heappop(self.retry_heap)
+            task = self.retry_tasks.pop(task_id)
+            task.error = ""
+            self.download_queue.restore(task)
+            self.progress_board.update(task_id, status="待機中")
+    
+    def _schedule_retry(self, task, delay):
+        """一時的なエラーで失敗したタスクをdelay秒後に再試行する（queue_lockを保持して呼ぶ）"""
+        task.attempts += 1
+        task.retry_at = time.monotonic() + delay
+        self.retry_tasks[task.task_id] = task
+        heapq.heappush(self.retry_heap, (task.retry_at, task.task_id))
+    
+    def _space_shortfall(self, task, save_dir):
+        """taskを始めると空き容量が足りなくなるなら(フォルダ, 使用状況, 必要量)を返す（queue_lockを保持して呼ぶ）"""
+        # 実行中・後処理中のタスクがこれから書き込む分は、既に確保されたものとして差し引く
+        tasks = dict(self.active_tasks)
+        tasks.update(self.postprocessing_tasks)
+        tasks[task.task_id] = task
+        work_dir = self.staging_dir or save_dir
+        # 分割したファイルと結合後のファイルが一時的に両方残る
+        needs = [(work_dir, sum(max(2 * other.estimated_total - other.downloaded_bytes, 0) for other in tasks.values()))]
+        if work_dir != save_dir and not same_device(work_dir, save_dir):
+            # 別のドライブの作業フォルダからは、保存先へコピーで移す
+            needs.append((save_dir, sum(other.estimated_total for other in tasks.values())))
+        for path, need in needs:
+            usage = disk_usage(path)
+            required = need + self.min_free_space
+            if usage is not None and usage.free < required:
+                return path, usage, required
+        return None
+    
+    def _hold_for_disk_space(self, task, shortfall, notices):
+        """空き容量が足りないタスクを元の位置でキューへ戻す（queue_lockを保持して呼ぶ。通知はnoticesへ積む）"""
+        queued_at = task.queued_at
+        task.disk_wait = True
+        self.download_queue.restore(task)
+        task.queued_at = queued_at
+        if self.disk_shortfall is None or self.disk_shortfall[0] != shortfall[0]:
+            path, usage, required = shortfall
+            message = f"💾 空き容量待ち: {path}（空き {format_bytes(usage.free)} / 必要 {format_bytes(required)}）"
+            notices.append(lambda: self._emit("status", message=message))
+        self.disk_shortfall = shortfall
+        self.progress_board.update(task.task_id, status="容量待ち", progress=0, speed=0, eta=None)
+    
+    def _fail_for_disk_space(self, task, shortfall, notices):
+        """空き容量が足りないタスクを、待たせずに空き容量不足の失敗とする（queue_lockを保持して呼ぶ。後始末はnoticesへ積む）"""
+        path, usage, required = shortfall
+        task.disk_wait = False
+        task.error = f"{path} の{ERROR_KINDS['disk_full']}（空き {format_bytes(usage.free)} / 必要 {format_bytes(required)}）"
+        self.completed_count += 1
+        # 履歴・キューの記録への書き込みとリスナーへの通知を伴う
+        notices.append(lambda: self._finish_task(task, False))
+    
+    def _pop_dispatchable_task(self):
+        """ホスト毎の上限に空きがあるタスクを、優先度順・同じ優先度ではホストを順番に回して取り出す"""
+        def has_host_slot(host):
+            host_limit = self.concurrency.host_limit(host)
+            return host_limit == 0 or self.host_active[host] < host_limit
+        return self.download_queue.pop_next(has_host_slot)
+    
+    def _on_download_done(self, task, future):
+        """ダウンロード完了時にワーカースレッドから呼ばれ、枠を解放して後処理用プールへ回す"""
+        try:
+            jobs = future.result()
+        except Exception as e:
+            jobs = None
+            task.error = task.error or str(e)
+        success = jobs is not None and not task.cancel_requested
+        paused = task.pause_requested
+        # ワーカーが空き容量不足を見つけた場合は失敗にせず、容量待ちとしてキューへ戻す
+        disk_wait = task.disk_wait and not task.cancel_requested and not paused
+        task.disk_wait = disk_wait
+        delay = None
+        if not success and not task.cancel_requested and not disk_wait:
+            task.error_kind = classify_error(task.error)
+            if task.error_kind in TRANSIENT_ERROR_KINDS and task.attempts < MAX_RETRIES:
+                delay = retry_delay(task.attempts)
+        
+        with self.queue_cond:
+            if not task.cancel_requested and not disk_wait:
+                self.concurrency.record_result(task.host, success, task.error_kind == "throttled",
+                                               self.host_active[task.host])
+            self.active_tasks.pop(task.task_id, None)
+            self.host_active[task.host] -= 1
+            if self.host_active[task.host] <= 0:
+                del self.host_active[task.host]
+            self.concurrency.release_connections(task.connections)
+            if paused:
+                self.paused_tasks[task.task_id] = task
+            elif disk_wait:
+                self._requeue_for_disk_space(task)
+            elif delay is not None:
+                self._schedule_retry(task, delay)
+            else:
+                self.completed_count += 1
+                self.completed_bytes += task.downloaded_bytes
+            if success:
+                self.postprocessing_tasks[task.task_id] = task
+            self.queue_cond.notify_all()
+        
+        if paused or disk_wait or delay is not None:
+            # 再開時は.partの続きから取得し、進捗もそこから数え直す
+            task.resumed = True
+            task.speed = 0.0
+            task.downloaded_bytes = task.finished_bytes = task.total_bytes = 0
+        if paused:
+            self._park_task(task)
+            return
+        if disk_wait:
+            self._on_disk_wait(task)
+            return
+        if delay is not None:
+            self._on_retry_scheduled(task, delay)
+            return
+        if not success:
+            self._finish_task(task, False)
+            return
+        self.progress_board.update(task.task_id, status="後処理待ち", progress=100, speed=0, eta=None)
+        post_future = self.post_executor.submit(self._postprocess_video, task, jobs)
+        post_future.add_done_callback(lambda f: self._on_postprocess_done(task, f))
+    
+    def _on_retry_scheduled(self, task, delay):
+        self.metrics.count("retries", task.error_kind)
+        if task.error_kind == "forbidden":
+            # 失効したメディアURLを使わないよう、次回は解決からやり直す
+            self.metadata_cache.invalidate(task.url)
+        self.progress_board.update(task.task_id, status=f"再試行待ち（{task.attempts}/{MAX_RETRIES}）",
+                                   progress=0, speed=0, eta=None)
+        self.queue_journal.record(task, "pending")
+        self._emit("status", message=f"🔁 {ERROR_KINDS[task.error_kind]}: {delay:.0f}秒後に再試行"
+                                     f"（{task.attempts}/{MAX_RETRIES}） {task.title or task.url}")
+    
+    def _on_disk_wait(self, task):
+        self.progress_board.update(task.task_id, status="容量待ち", progress=0, speed=0, eta=None)
+        self.queue_journal.record(task, "pending")
+        self._emit("status", message=f"💾 空き容量が足りないため待機します: {task.title or task.url}")
+    
+    def _requeue_for_disk_space(self, task):
+        """ワーカーで空き容量不足になったタスクを、元の位置で容量待ちとしてキューへ戻す（queue_lockを保持して呼ぶ）"""
+        task.error = ""
+        self.download_queue.restore(task)
+    
+    def _on_postprocess_done(self, task, future):
+        try:
+            success = future.result()
+        except Exception as e:
+            success = False
+            task.error = task.error or str(e)
+        # 結合・移動中に容量が尽きた場合も、再試行の回数の範囲で容量待ちとしてキューへ戻す
+        # （結合済みのファイルや分割したファイルは残っているので、次回はその続きから仕上げる）
+        disk_wait = (not success and not task.cancel_requested and classify_error(task.error) == "disk_full"
+                     and task.attempts < MAX_RETRIES)
+        with self.queue_cond:
+            self.postprocessing_tasks.pop(task.task_id, None)
+            if disk_wait:
+                task.attempts += 1
+                task.disk_wait = True
+                self.completed_count -= 1
+                self.completed_bytes -= task.downloaded_bytes
+                self._requeue_for_disk_space(task)
+            self.queue_cond.notify_all()
+        if disk_wait:
+            task.resumed = True
+            task.downloaded_bytes = task.finished_bytes = task.total_bytes = 0
+            self._on_disk_wait(task)
+            return
+        self._finish_task(task, success)
+    
+    def _finish_task(self, task, success):
+        """ダウンロード・後処理を終えたタスクを履歴へ移す"""
+        if success:
+            status = "⏭" if task.skipped else "✅"
+            self.download_index.record_download(task.url, task.archive_ids)
+            task.error_kind = ""
+        else:
+            status = "⏹" if task.cancel_requested else "❌"
+            task.error_kind = "" if task.cancel_requested else classify_error(task.error)
+        self.download_index.remove_queued(task.url)
+        self.progress_board.discard(task.task_id)
+        self.queue_journal.record(task, "done")
+        self._release_output_names([task])
+        
+        postprocess = format_postprocess_times(task.postprocess_times)
+        if success:
+            message = f"{status} {task.title[:40]}" + (f"（{postprocess}）" if postprocess else "")
+            self._emit("status", message=message)
+        elif not task.cancel_requested:
+            self._emit("status", message=f"❌ {ERROR_KINDS[task.error_kind]}: {task.error}")
+        entry = self._add_to_history(status, task.title, task.url, postprocess, task.error_kind, task.error)
+        self._record_task_metrics(task, status)
+        self._emit("task_finished", task=task, entry=entry)
+    
+    def _record_task_metrics(self, task, status):
+        """完了したタスクの段階ごとの所要時間を集計し、計測ログへ1行書く"""
+        result = TASK_RESULT_LABELS[status]
+        self.metrics.count("tasks", result)
+        if task.error_kind:
+            self.metrics.count("errors", task.error_kind)
+        if self.metrics_log is None:
+            return
+        download = task.timings.get("download", 0.0)
+        self.metrics_log.write({
+            "type": "task",
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "id": task.task_id,
+            "url": task.url,
+            "host": task.host,
+            "result": result,
+            "error_kind": task.error_kind,
+            "error": task.error,
+            "attempts": task.attempts,
+            "bytes": task.downloaded_bytes,
+            "throughput": task.downloaded_bytes / download if download > 0 else None,
+            "connections": task.connections,
+            "timings": {stage: round(seconds, 4) for stage, seconds in task.timings.items()},
+            "postprocess_steps": {step: round(seconds, 4) for step, seconds in task.postprocess_times.items()},
+        })
+    
+    def _metrics_snapshot(self):
+        """計測ログへ定期的に書く全体の集計値（実行中でなければNone）"""
+        if not self.is_running:
+            return None
+        record = {"type": "snapshot", "time": datetime.now().isoformat(timespec="seconds")}
+        record.update(self.stats())
+        record.update(self.metrics.snapshot())
+        board = self.progress_board
+        record["progress_events"] = board.event_count
+        record["progress_applied"] = board.applied_count
+        return record
+    
+    def _add_to_history(self, status, title, url, postprocess="", error_kind="", error=""):
+        entry = {
+            "time": datetime.now().strftime("%Y-%m-%d %H:%M"),
+            "status": status,
+            "title": title if title else url[:50],
+            "url": url,
+            "postprocess": postprocess
+        }
+        if error_kind:
+            # 後で失敗分をまとめて再試行できるよう、原因も残す
+            entry["error_kind"] = error_kind
+            entry["error"] = error
+        # 書き込みは履歴ストアのスレッドで行う
+        self.history_store.append(entry)
+        return entry
+    
+    def _progress_hook(self, task, d):
+        if task.cancel_requested:
+            raise yt_dlp.utils.DownloadCancelled("中止")
+        
+        status = d.get('status', '')
+        if status == 'downloading':
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            self._record_bytes(task, downloaded, total, d.get('speed'))
+            fragment_index = d.get('fragment_index')
+            fragment_count = d.get('fragment_count')
+            
+            percent = None
+            if task.estimated_total > 0:
+                percent = min(task.downloaded_bytes / task.estimated_total, 1.0) * 100
+            elif fragment_index and fragment_count and fragment_count > 0:
+                percent = (fragment_index / fragment_count) * 100
+            elif '_percent_str' in d:
+                try:
+                    percent = float(d.get('_percent_str', '0').strip().replace('%', ''))
+                except:
+                    pass
+            
+            if percent is not None:
+                task.progress = percent
+            self._apply_rate_share(task)
+            self.progress_board.update(task.task_id, status="DL中", progress=task.progress,
+                                       speed=task.speed, eta=task.eta)
+        
+        elif status == 'finished':
+            # 複数ファイルのタスクでは次のファイルの進捗が0から始まるため、完了分を積み上げる
+            size = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            self._record_bytes(task, size, size, 0)
+            task.finished_bytes = task.downloaded_bytes
+            self.progress_board.update(task.task_id, status="DL中", progress=task.progress)
+    
+    def _record_bytes(self, task, downloaded, total, speed):
+        """現在のファイルの進捗をタスク全体のバイト数に反映し、増分を合計速度に加算する"""
+        cumulative = task.finished_bytes + downloaded
+        received = cumulative - task.downloaded_bytes
+        if received > 0:
+            self.throughput.add(received)
+            self.metrics.count("bytes", amount=received)
+            if "ttfb" not in task.timings and task.download_started is not None:
+                # ダウンロード開始から最初のデータを受け取るまで
+                ttfb = time.monotonic() - task.download_started
+                task.add_timing("ttfb", ttfb)
+                self.metrics.observe("ttfb", ttfb)
+            task.downloaded_bytes = cumulative
+        if total > 0:
+            task.total_bytes = task.finished_bytes + total
+        task.speed = speed or 0.0
+        if received > 0:
+            self._throttle(task, received)
+    
+    def _throttle(self, task, amount):
+        """帯域の上限を超えた分だけワーカーを待たせる（中止・一時停止はすぐに反映する）"""
+        deadline = time.monotonic() + self.bandwidth.throttle(task.host, amount)
+        while not task.cancel_requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, 0.25))
+    
+    def _apply_rate_share(self, task):
+        """実行中のタスク数に応じてyt-dlpのratelimitを配分し直す（合計が上限に収まるように）"""
+        now = time.monotonic()
+        ydl = task.current_ydl
+        if ydl is None or now - task.ratelimit_checked < BANDWIDTH_REBALANCE_INTERVAL:
+            return
+        task.ratelimit_checked = now
+        share = self.bandwidth.share(task.host, len(self.active_tasks), self.host_active[task.host])
+        # フラグメントを並列取得する場合は接続ごとに効くため、接続数で割る（プログレッシブは1本の接続）
+        connections = task.connections if task.fragmented else 1
+        ydl.params['ratelimit'] = share / connections if share else None
+    
+    def _extract_info(self, ydl, task):
+        """URLを解決し、キャッシュが有効なら保存する"""
+        started = time.monotonic()
+        try:
+            info = ydl.extract_info(task.url, download=False)
+        finally:
+            elapsed = time.monotonic() - started
+            task.add_timing("extract", elapsed)
+            self.metrics.observe("extract", elapsed)
+        if self.metadata_cache.enabled:
+            self.metadata_cache.put(task.url, ydl.sanitize_info(info))
+        return info
+    
+    def _download_video(self, task, save_dir):
+        """URLを解決して選択されたフォーマットをダウンロードし、後処理のジョブを返す（失敗時はNone）"""
+        self._emit("status", message=f"⬇ {task.url[:50]}...")
+        
+        # 作成時に決まる設定（書き込み先・フォーマット・アーカイブ）が同じなら同じホストのインスタンスを使い回す
+        work_dir = self.staging_dir or save_dir
+        key = (task.host, work_dir, self.post_processing, self.skip_existing)
+        ydl = slot = None
+        try:
+            ydl, slot = self.ydl_pool.acquire(key, lambda: self._create_ydl(work_dir))
+            # 進捗通知とフラグメント並列数はタスクごとに差し替える
+            slot["task"] = task
+            ydl.params['concurrent_fragment_downloads'] = task.connections
+            task.current_ydl = ydl
+            # 帯域制限の配分（実行中も進捗通知のたびに見直す）
+            task.ratelimit_checked = 0.0
+            self._apply_rate_share(task)
+            if task.cancel_requested:
+                raise yt_dlp.utils.DownloadCancelled("中止")
+            
+            # 解決は1回だけ行い、その結果をそのままダウンロードに使う
+            info = self.metadata_cache.get(task.url)
+            from_cache = info is not None
+            if info is None:
+                info = self._extract_info(ydl, task)
+            if info is None:
+                # ダウンロードアーカイブに記録済み
+                task.skipped = True
+                return []
+            task.title = info.get('title', '不明')
+            task.expected_bytes = estimate_filesize(info)
+            if task.expected_bytes and not self._check_disk_space(task, save_dir):
+                return None
+            
+            if task.cancel_requested:
+                raise yt_dlp.utils.DownloadCancelled("中止")
+            
+            try:
+                jobs = self._download_entries(ydl, task, info, save_dir)
+            except yt_dlp.utils.DownloadError:
+                if not from_cache or task.cancel_requested:
+                    raise
+                # キャッシュ内のメディアURLが失効している可能性があるため、解決し直して再試行
+                self.metadata_cache.invalidate(task.url)
+                info = self._extract_info(ydl, task)
+                jobs = self._download_entries(ydl, task, info, save_dir)
+        
+            if not task.cancel_requested:
+                return jobs
+        
+        except yt_dlp.utils.DownloadCancelled:
+            return None
+        except Exception as e:
+            task.error = str(e)
+            # 失敗したインスタンスは状態（Cookie・接続）が壊れている可能性があるため使い回さない
+            self.ydl_pool.discard(key)
+            if classify_error(task.error) == "disk_full" and task.attempts < MAX_RETRIES:
+                # 途中で容量が尽きた場合は.partを残したまま容量待ちにする
+                task.attempts += 1
+                task.disk_wait = True
+            return None
+        finally:
+            if slot is not None:
+                slot["task"] = None
+            task.current_ydl = None
+        
+        return None
+    
+    def _check_disk_space(self, task, save_dir):
+        """サイズが分かった時点で空き容量を確かめる。足りなければ容量待ち（入りきらなければ失敗）にしてFalse"""
+        with self.queue_lock:
+            shortfall = self._space_shortfall(task, save_dir)
+        if shortfall is None:
+            return True
+        path, usage, _ = shortfall
+        if 2 * task.expected_bytes + self.min_free_space > usage.total:
+            # 他のタスクが終わるのを待っても入りきらない
+            task.error = (f"{path} の{ERROR_KINDS['disk_full']}（必要 {format_bytes(2 * task.expected_bytes)} / "
+                          f"容量 {format_bytes(usage.total)}）")
+        else:
+            task.disk_wait = True
+        return False
+    
+    def _create_ydl(self, work_dir):
+        """ワーカースレッド・ホストごとに使い回すYoutubeDLと、進捗通知の送り先を入れる枠を作る"""
+        if self.post_processing == "transcode":
+            # 明示的に選んだ場合のみ、後処理でmp4へ再エンコードする
+            video_format = 'bestvideo+bestaudio/best'
+        else:
+            # mp4に格納できるコーデックを優先し、コンテナの詰め替え（ストリームコピー）だけで済ませる
+            video_format = REMUX_FORMAT
+        
+        # フラグメントの並列取得では別スレッドから呼ばれるため、スレッドローカルではなく枠で現在のタスクを渡す
+        slot = {"task": None}
+        
+        def progress_hook(d):
+            task = slot["task"]
+            if task is not None:
+                self._progress_hook(task, d)
+        
+        ydl_opts = {
+            'format': video_format,
+            'merge_output_format': 'mp4',
+            'outtmpl': os.path.join(work_dir, '%(title)s.%(ext)s'),
+            'progress_hooks': [progress_hook],
+            # 中断・再試行時は.partファイル（フラグメントは.ytdlの位置）から続きを取得する
+            'continuedl': True,
+            'quiet': True,
+            'no_warnings': True,
+            # 進捗はprogress_hooksで扱うため、yt-dlp自身の進捗表示は出さない（CLIの出力を汚さないように）
+            'noprogress': True,
+            # ネイティブのフラグメントダウンローダーで複数フラグメントを並列取得する
+            'hls_prefer_native': True,
+            'concurrent_fragment_downloads': DEFAULT_CONCURRENT_FRAGMENTS,
+            'fragment_retries': YTDLP_FRAGMENT_RETRIES,
+            'retries': YTDLP_RETRIES,
+            'retry_sleep_functions': {'http': ytdlp_retry_sleep, 'fragment': ytdlp_retry_sleep},
+            'socket_timeout': 30,
+            'http_headers': {
+                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            },
+        }
+        if self.skip_existing:
+            # アーカイブにある動画はyt-dlpが解決前（URLから動画IDが分かる場合）に除外する
+            ydl_opts['download_archive'] = DOWNLOAD_ARCHIVE_FILE
+        return yt_dlp.YoutubeDL(ydl_opts), slot
+    
+    def _download_entries(self, ydl, task, info, save_dir):
+        videos = info.get('entries') if info.get('_type') == 'playlist' else [info]
+        task.download_started = time.monotonic()
+        try:
+            jobs = [self._download_formats(ydl, task, video, save_dir) for video in videos or [] if video]
+        finally:
+            elapsed = time.monotonic() - task.download_started
+            task.download_started = None
+            task.add_timing("download", elapsed)
+            self.metrics.observe("download", elapsed)
+        if any(job.parts for job in jobs):
+            task.skipped = False
+        return jobs
+    
+    def _download_formats(self, ydl, task, video, save_dir):
+        """選択されたフォーマットを個別のファイルとして取得する（結合は後処理用プールで行う）"""
+        # 作業フォルダを使う場合、ファイルはそこへ書き、仕上がったものだけを保存先へ移す
+        base, _ = os.path.splitext(ydl.prepare_filename(video))
+        archive_id = make_archive_id(video)
+        if archive_id and archive_id not in task.archive_ids:
+            # キューでの再試行では同じ動画を取り直すので、二重に記録しない
+            task.archive_ids.append(archive_id)
+        downloaded = bool(archive_id) and self.download_index.is_downloaded_id(archive_id)
+        output_path = os.path.join(save_dir, f"{os.path.basename(base)}.mp4")
+        if self.skip_existing and downloaded:
+            # 別のURLから取得済みの動画
+            task.skipped = True
+            return PostProcessJob([], output_path)
+        if downloaded and self.download_index.is_downloaded_url(task.url) and os.path.exists(output_path):
+            # このURLのこの動画は後処理まで済んでいるので何もしない
+            return PostProcessJob([], output_path)
+        # 同じタイトルの別の動画は上書きせず、空いている名前にする
+        base = self._claim_output_name(task, base, save_dir)
+        work_path = f"{base}.mp4"
+        output_path = os.path.join(save_dir, os.path.basename(work_path))
+        if work_path != output_path and os.path.exists(work_path):
+            # 作業フォルダで仕上がったまま、保存先へ移す前に止まっていた
+            return PostProcessJob([], output_path, work_path)
+        
+        parts = []
+        for fmt in video.get('requested_formats') or [video]:
+            fmt_info = dict(video)
+            fmt_info.update(fmt)
+            fmt_info.pop('requested_formats', None)
+            path = f"{base}.f{fmt.get('format_id', '0')}.{fmt.get('ext', 'mp4')}"
+            # 映像と音声でプロトコルが異なることがあるため、フォーマットごとに配分を見直す
+            task.fragmented = (fmt_info.get('protocol') or '').startswith(FRAGMENTED_PROTOCOLS)
+            task.ratelimit_checked = 0.0
+            self._apply_rate_share(task)
+            success, _ = ydl.dl(path, fmt_info)
+            if not success:
+                raise yt_dlp.utils.DownloadError(f"ダウンロードに失敗しました: {fmt.get('format_id')}")
+            parts.append((path, fmt))
+        return PostProcessJob(parts, output_path, work_path)
+    
+    def _claim_output_name(self, task, base, save_dir):
+        """保存先の既存ファイルや実行中の他のタスクと重ならない名前（拡張子なし）を決めて確保する"""
+        # 同じタスクの再試行・再開では同じ名前になる（.partの続きから取得できるように）
+        directory, name = os.path.split(base)
+        candidate = name
+        number = 1
+        with self.queue_lock:
+            while True:
+                path = os.path.join(save_dir, f"{candidate}.mp4")
+                owner = self.claimed_outputs.get(path)
+                if owner == task.task_id:
+                    break
+                if owner is None and not os.path.exists(path):
+                    break
+                number += 1
+                candidate = f"{name} ({number})"
+            self.claimed_outputs[path] = task.task_id
+        return os.path.join(directory, candidate)
+    
+    def _postprocess_video(self, task, jobs):
+        """ダウンロード済みのファイルをmp4にまとめ、作業フォルダから保存先へ移す（後処理用プールで実行）"""
+        if not any(job.parts or job.work_path != job.output_path for job in jobs):
+            return self._run_postprocess(task, jobs)
+        started = time.monotonic()
+        try:
+            return self._run_postprocess(task, jobs)
+        finally:
+            elapsed = time.monotonic() - started
+            task.add_timing("postprocess", elapsed)
+            self.metrics.observe("postprocess", elapsed)
+    
+    def _run_postprocess(self, task, jobs):
+        ffmpeg = shutil.which("ffmpeg")
+        for job in jobs:
+            if task.cancel_requested:
+                return False
+            if job.parts and not self._merge_parts(task, job, ffmpeg):
+                return False
+            if job.work_path != job.output_path and os.path.exists(job.work_path):
+                self.progress_board.update(task.task_id, status="保存先へ移動中", progress=100)
+                move_into_place(job.work_path, job.output_path)
+        return True
+    
+    def _merge_parts(self, task, job, ffmpeg):
+        """分割したファイルをjob.work_pathのmp4にまとめる"""
+        base, _ = os.path.splitext(job.work_path)
+        tmp_path = f"{base}.temp.mp4"
+        step, command = build_postprocess_command(ffmpeg, job.parts, self.post_processing, tmp_path)
+        if step is None:
+            os.replace(job.parts[0][0], job.work_path)
+            return True
+        if ffmpeg is None:
+            task.error = "FFmpegが見つかりません"
+            return False
+        
+        self.progress_board.update(task.task_id, status=f"{POSTPROCESSOR_LABELS[step]}中", progress=100)
+        started = time.monotonic()
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+        task.ffmpeg_process = process
+        _, stderr = process.communicate()
+        task.ffmpeg_process = None
+        task.postprocess_times[step] = task.postprocess_times.get(step, 0.0) + time.monotonic() - started
+        
+        if process.returncode != 0 or task.cancel_requested:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if not task.cancel_requested:
+                lines = stderr.decode("utf-8", errors="replace").strip().splitlines()
+                task.error = f"ffmpeg: {lines[-1] if lines else process.returncode}"
+            return False
+        
+        os.replace(tmp_path, job.work_path)
+        for path, _ in job.parts:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return True
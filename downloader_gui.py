@@ -0,0 +1,745 @@
+"""
+動画ダウンローダーのGUI
+ダウンロードエンジンの上に載る薄いtkinterクライアント
+"""
+
+import os
+import time
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk, filedialog
+from collections import Counter
+
+from downloader_engine import (
+    DownloadEngine,
+    ERROR_KINDS,
+    MAX_BANDWIDTH_LIMIT,
+    MAX_CONCURRENT_DOWNLOADS,
+    MAX_CONCURRENT_FRAGMENTS,
+    MAX_CONNECTION_BUDGET,
+    MAX_METADATA_CACHE_TTL,
+    POST_PROCESSING_MODES,
+    PRIORITY_LEVELS,
+    format_bytes,
+    format_eta,
+    format_stats,
+    iter_import_urls,
+    load_settings,
+    save_settings,
+)
+
+# 履歴を画面に一度に読み込む件数
+HISTORY_PAGE_SIZE = 200
+
+# 一括追加：画面のキューへ1回に追加する件数と、その間隔（ミリ秒）
+INGEST_BATCH_SIZE = 200
+INGEST_INTERVAL_MS = 50
+
+# 進捗表示の更新頻度（Hz）
+DEFAULT_UI_REFRESH_HZ = 10
+MAX_UI_REFRESH_HZ = 30
+
+# イベントループの遅れを計測する間隔（ミリ秒）
+LOOP_LAG_PROBE_MS = 250
+
+
+class VideoDownloaderApp:
+    def __init__(self, root):
+        self.root = root
+        self.root.title("動画ダウンローダー")
+        self.root.geometry("700x500")
+        self.root.minsize(600, 400)
+        
+        # 設定を読み込む
+        self.settings = load_settings()
+        
+        # キュー・ダウンロード・履歴はエンジンが扱い、画面は通知を受けて反映するだけ
+        self.engine = DownloadEngine(self.settings)
+        self.engine.add_listener(self._on_engine_event)
+        
+        # 保存先
+        default_save_path = self.settings.get("save_path", os.getcwd())
+        if not os.path.isdir(default_save_path):
+            default_save_path = os.getcwd()
+        self.save_path = tk.StringVar(value=default_save_path)
+        # 作業フォルダ（空なら保存先に直接書く）
+        self.staging_dir = tk.StringVar(value=self.engine.staging_dir)
+        
+        # 同時ダウンロード数
+        concurrency = self.engine.concurrency
+        self.concurrent_downloads = tk.IntVar(value=concurrency.max_limit)
+        self.adaptive_concurrency = tk.BooleanVar(value=concurrency.adaptive)
+        self.per_host_limit = tk.IntVar(value=concurrency.per_host_limit)
+        self.concurrent_fragments = tk.IntVar(value=concurrency.fragment_limit)
+        self.connection_budget = tk.IntVar(value=concurrency.connection_budget)
+        
+        # 帯域制限（ホスト毎・時間帯の設定はsettings.jsonで行う）
+        self.bandwidth_limit = tk.IntVar(value=self.engine.bandwidth.limit)
+        
+        # メタデータキャッシュ
+        self.metadata_cache_ttl = tk.IntVar(value=self.engine.metadata_cache.ttl_minutes)
+        
+        # 進捗表示の更新頻度
+        default_refresh_hz = self.settings.get("ui_refresh_hz", DEFAULT_UI_REFRESH_HZ)
+        self.ui_refresh_hz = tk.IntVar(value=default_refresh_hz)
+        
+        # 取得済みのスキップ
+        self.skip_existing = tk.BooleanVar(value=self.engine.skip_existing)
+        
+        # 設定パネル表示フラグ
+        self.settings_visible = tk.BooleanVar(value=False)
+        
+        # ダウンロード状態
+        self.is_downloading = False
+        # task_id → Treeviewの行ID、行ID → タスク
+        self.queue_items = {}
+        self.queue_item_tasks = {}
+        self.ui_tick_job = None
+        
+        # 履歴（画面にはページ単位で読み込む）
+        self.history_next_offset = None
+        
+        # 一括追加（取り込みスレッド → 受け渡し口 → UIスレッドでまとめてキューへ）
+        self.ingest_inbox = queue.SimpleQueue()
+        self.ingest_running = 0
+        self.ingest_job = None
+        self.ingest_stats = Counter()
+        
+        self._setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+        
+        # 履歴をUIに反映
+        self._restore_history_to_ui()
+        
+        # 前回終了時に残っていたキューを復元
+        self.engine.restore_queue()
+        
+        self._probe_loop_lag()
+    
+    def _save_settings(self, new_settings):
+        self.settings.update(new_settings)
+        save_settings(self.settings)
+    
+    def _on_close(self):
+        self.engine.close()
+        self.root.destroy()
+    
+    def _on_engine_event(self, event, data):
+        """エンジンからの通知（ワーカースレッドからも呼ばれる）をUIスレッドへ渡す"""
+        self.root.after(0, self._handle_engine_event, event, data)
+    
+    def _handle_engine_event(self, event, data):
+        if event == "queued":
+            for task in data["tasks"]:
+                if task.pause_requested:
+                    self._insert_queue_row(task, "一時停止")
+                else:
+                    self._insert_queue_row(task, "中断" if task.resumed else "待機中")
+            self._update_tab_counts()
+        elif event == "reordered":
+            # 待機中の行を取り出される順に並べ直す（実行中・一時停止中の行はその上に残る）
+            for task_id in data["task_ids"]:
+                item = self.queue_items.get(task_id)
+                if item is not None:
+                    self.queue_tree.move(item, "", tk.END)
+                    self._update_queue_item(task_id)
+        elif event == "paused":
+            for task_id in data["task_ids"]:
+                self._update_queue_item(task_id, "一時停止")
+        elif event == "resumed":
+            for task_id in data["task_ids"]:
+                self._update_queue_item(task_id, "再開待ち")
+        elif event == "removed":
+            for task_id in data["task_ids"]:
+                self._remove_queue_item(task_id)
+        elif event == "status":
+            self._update_status(data["message"])
+        elif event == "task_finished":
+            self._remove_queue_item(data["task"].task_id)
+            self._add_to_history(data["entry"])
+        elif event == "finished":
+            self._ui_tick()
+            self._set_downloading_state(False)
+            self._update_status(data["summary"])
+    
+    def _restore_history_to_ui(self):
+        """保存された履歴を新しい順に1ページ分だけUIに反映"""
+        entries, self.history_next_offset = self.engine.history_store.read_page(HISTORY_PAGE_SIZE)
+        self._insert_history_rows(entries)
+    
+    def _load_more_history(self):
+        if not self.history_next_offset:
+            return
+        entries, self.history_next_offset = self.engine.history_store.read_page(HISTORY_PAGE_SIZE,
+                                                                                self.history_next_offset)
+        self._insert_history_rows(entries)
+    
+    def _insert_history_rows(self, entries):
+        for item in entries:
+            self.history_tree.insert("", tk.END, values=(
+                item.get("time", ""),
+                item.get("status", ""),
+                item.get("postprocess", ""),
+                ERROR_KINDS.get(item.get("error_kind"), ""),
+                item.get("title", "")
+            ))
+        self.more_history_btn.config(state=tk.NORMAL if self.history_next_offset else tk.DISABLED)
+        self._update_tab_counts()
+    
+    def _setup_ui(self):
+        """UIコンポーネントをセットアップ"""
+        main_frame = ttk.Frame(self.root, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        # === URL入力 + ボタン ===
+        input_frame = ttk.Frame(main_frame)
+        input_frame.pack(fill=tk.X, pady=(0, 8))
+        
+        self.url_entry = ttk.Entry(input_frame, font=("", 10))
+        self.url_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 5))
+        self.url_entry.insert(0, "URLを貼り付け...")
+        self.url_entry.bind("<FocusIn>", self._on_url_focus_in)
+        self.url_entry.bind("<FocusOut>", self._on_url_focus_out)
+        self.url_entry.bind("<Return>", lambda e: self._add_to_queue())
+        
+        ttk.Button(input_frame, text="➕", width=3, command=self._add_to_queue).pack(side=tk.LEFT, padx=2)
+        ttk.Button(input_frame, text="📥", width=3, command=self._open_bulk_import).pack(side=tk.LEFT, padx=2)
+        
+        self.download_btn = ttk.Button(input_frame, text="▶", width=3, command=self._start_queue_download)
+        self.download_btn.pack(side=tk.LEFT, padx=2)
+        
+        self.cancel_btn = ttk.Button(input_frame, text="⏹", width=3, command=self._cancel_all_downloads, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT, padx=2)
+        
+        ttk.Button(input_frame, text="⚙", width=3, command=self._toggle_settings).pack(side=tk.LEFT, padx=2)
+        
+        # === 設定パネル（折りたたみ） ===
+        self.settings_frame = ttk.LabelFrame(main_frame, text="設定", padding="8")
+        
+        settings_row1 = ttk.Frame(self.settings_frame)
+        settings_row1.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(settings_row1, text="保存先:").pack(side=tk.LEFT)
+        ttk.Entry(settings_row1, textvariable=self.save_path, width=50).pack(side=tk.LEFT, padx=5)
+        ttk.Button(settings_row1, text="...", width=3, command=self._browse_folder).pack(side=tk.LEFT)
+        
+        settings_row_staging = ttk.Frame(self.settings_frame)
+        settings_row_staging.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(settings_row_staging, text="作業フォルダ:").pack(side=tk.LEFT)
+        ttk.Entry(settings_row_staging, textvariable=self.staging_dir, width=44,
+                  state="readonly").pack(side=tk.LEFT, padx=5)
+        ttk.Button(settings_row_staging, text="...", width=3, command=self._browse_staging_dir).pack(side=tk.LEFT)
+        ttk.Button(settings_row_staging, text="✕", width=3,
+                   command=lambda: self._set_staging_dir("")).pack(side=tk.LEFT, padx=2)
+        
+        settings_row2 = ttk.Frame(self.settings_frame)
+        settings_row2.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(settings_row2, text="同時DL:").pack(side=tk.LEFT)
+        ttk.Spinbox(settings_row2, from_=1, to=MAX_CONCURRENT_DOWNLOADS, 
+                    textvariable=self.concurrent_downloads, width=5
+        ).pack(side=tk.LEFT, padx=5)
+        self.concurrent_downloads.trace_add("write", self._on_concurrency_changed)
+        
+        ttk.Checkbutton(settings_row2, text="自動調整", variable=self.adaptive_concurrency,
+                        command=self._on_adaptive_changed).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(settings_row2, text="ホスト毎(0=無制限):").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(settings_row2, from_=0, to=MAX_CONCURRENT_DOWNLOADS,
+                    textvariable=self.per_host_limit, width=5
+        ).pack(side=tk.LEFT, padx=5)
+        self.per_host_limit.trace_add("write", self._on_concurrency_changed)
+        
+        settings_row_fragments = ttk.Frame(self.settings_frame)
+        settings_row_fragments.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(settings_row_fragments, text="フラグメント並列:").pack(side=tk.LEFT)
+        ttk.Spinbox(settings_row_fragments, from_=1, to=MAX_CONCURRENT_FRAGMENTS,
+                    textvariable=self.concurrent_fragments, width=5
+        ).pack(side=tk.LEFT, padx=5)
+        self.concurrent_fragments.trace_add("write", self._on_concurrency_changed)
+        
+        ttk.Label(settings_row_fragments, text="総接続数:").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(settings_row_fragments, from_=1, to=MAX_CONNECTION_BUDGET,
+                    textvariable=self.connection_budget, width=5
+        ).pack(side=tk.LEFT, padx=5)
+        self.connection_budget.trace_add("write", self._on_concurrency_changed)
+        
+        settings_row_post = ttk.Frame(self.settings_frame)
+        settings_row_post.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(settings_row_post, text="後処理:").pack(side=tk.LEFT)
+        self.post_processing_combo = ttk.Combobox(settings_row_post, state="readonly", width=30,
+                                                  values=list(POST_PROCESSING_MODES.values()))
+        self.post_processing_combo.set(POST_PROCESSING_MODES[self.engine.post_processing])
+        self.post_processing_combo.pack(side=tk.LEFT, padx=5)
+        self.post_processing_combo.bind("<<ComboboxSelected>>", self._on_post_processing_changed)
+        
+        ttk.Checkbutton(settings_row_post, text="取得済みをスキップ", variable=self.skip_existing,
+                        command=self._on_skip_existing_changed).pack(side=tk.LEFT, padx=10)
+        
+        settings_row_bandwidth = ttk.Frame(self.settings_frame)
+        settings_row_bandwidth.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(settings_row_bandwidth, text="帯域制限(KB/s, 0=無制限):").pack(side=tk.LEFT)
+        ttk.Spinbox(settings_row_bandwidth, from_=0, to=MAX_BANDWIDTH_LIMIT, increment=100,
+                    textvariable=self.bandwidth_limit, width=8
+        ).pack(side=tk.LEFT, padx=5)
+        self.bandwidth_limit.trace_add("write", self._on_bandwidth_limit_changed)
+        
+        settings_row3 = ttk.Frame(self.settings_frame)
+        settings_row3.pack(fill=tk.X, pady=2)
+        
+        ttk.Label(settings_row3, text="メタデータキャッシュ(分):").pack(side=tk.LEFT)
+        ttk.Spinbox(settings_row3, from_=0, to=MAX_METADATA_CACHE_TTL, increment=5,
+                    textvariable=self.metadata_cache_ttl, width=5,
+                    command=self._on_cache_ttl_changed
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(settings_row3, text="画面更新(Hz):").pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Spinbox(settings_row3, from_=1, to=MAX_UI_REFRESH_HZ,
+                    textvariable=self.ui_refresh_hz, width=5,
+                    command=lambda: self._save_settings({"ui_refresh_hz": self.ui_refresh_hz.get()})
+        ).pack(side=tk.LEFT, padx=5)
+        
+        # === 進捗バー ===
+        progress_frame = ttk.Frame(main_frame)
+        progress_frame.pack(fill=tk.X, pady=(0, 8))
+        
+        self.progress_var = tk.DoubleVar(value=0)
+        self.progress_bar = ttk.Progressbar(progress_frame, variable=self.progress_var, maximum=100)
+        self.progress_bar.pack(fill=tk.X)
+        
+        # === タブ：キュー / 履歴 ===
+        self.notebook = ttk.Notebook(main_frame)
+        self.notebook.pack(fill=tk.BOTH, expand=True)
+        
+        # キュータブ
+        queue_tab = ttk.Frame(self.notebook, padding="5")
+        self.notebook.add(queue_tab, text="キュー (0)")
+        
+        queue_frame = ttk.Frame(queue_tab)
+        queue_frame.pack(fill=tk.BOTH, expand=True)
+        
+        self.queue_tree = ttk.Treeview(
+            queue_frame,
+            columns=("status", "priority", "progress", "speed", "eta", "title"),
+            show="headings",
+            height=8
+        )
+        self.queue_tree.heading("status", text="状態")
+        self.queue_tree.heading("priority", text="優先度")
+        self.queue_tree.heading("progress", text="進捗")
+        self.queue_tree.heading("speed", text="速度")
+        self.queue_tree.heading("eta", text="残り")
+        self.queue_tree.heading("title", text="タイトル/URL")
+        self.queue_tree.column("status", width=80, anchor="center")
+        self.queue_tree.column("priority", width=50, anchor="center")
+        self.queue_tree.column("progress", width=60, anchor="center")
+        self.queue_tree.column("speed", width=80, anchor="center")
+        self.queue_tree.column("eta", width=60, anchor="center")
+        self.queue_tree.column("title", width=260)
+        
+        queue_scroll = ttk.Scrollbar(queue_frame, orient=tk.VERTICAL, command=self.queue_tree.yview)
+        self.queue_tree.configure(yscrollcommand=queue_scroll.set)
+        self.queue_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        queue_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # キュー操作
+        queue_btn = ttk.Frame(queue_tab)
+        queue_btn.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(queue_btn, text="🗑 削除", command=self._remove_from_queue).pack(side=tk.LEFT, padx=2)
+        ttk.Button(queue_btn, text="🧹 クリア", command=self._clear_queue).pack(side=tk.LEFT, padx=2)
+        ttk.Button(queue_btn, text="⏸", width=3, command=self._pause_selected).pack(side=tk.LEFT, padx=(10, 2))
+        ttk.Button(queue_btn, text="⏯", width=3, command=self._resume_selected).pack(side=tk.LEFT, padx=2)
+        ttk.Button(queue_btn, text="⏫", width=3, command=lambda: self._move_selected(True)).pack(side=tk.LEFT, padx=2)
+        ttk.Button(queue_btn, text="⏬", width=3, command=lambda: self._move_selected(False)).pack(side=tk.LEFT, padx=2)
+        
+        ttk.Label(queue_btn, text="優先度:").pack(side=tk.LEFT, padx=(10, 0))
+        self.priority_combo = ttk.Combobox(queue_btn, state="readonly", width=6, values=list(PRIORITY_LEVELS.values()))
+        self.priority_combo.pack(side=tk.LEFT, padx=2)
+        self.priority_combo.bind("<<ComboboxSelected>>", self._on_priority_selected)
+        
+        # 履歴タブ
+        history_tab = ttk.Frame(self.notebook, padding="5")
+        self.notebook.add(history_tab, text="履歴 (0)")
+        
+        history_frame = ttk.Frame(history_tab)
+        history_frame.pack(fill=tk.BOTH, expand=True)
+        
+        self.history_tree = ttk.Treeview(
+            history_frame,
+            columns=("time", "status", "postprocess", "reason", "title"),
+            show="headings",
+            height=8
+        )
+        self.history_tree.heading("time", text="時刻")
+        self.history_tree.heading("status", text="結果")
+        self.history_tree.heading("postprocess", text="後処理")
+        self.history_tree.heading("reason", text="失敗理由")
+        self.history_tree.heading("title", text="タイトル")
+        self.history_tree.column("time", width=110, anchor="center")
+        self.history_tree.column("status", width=60, anchor="center")
+        self.history_tree.column("postprocess", width=140, anchor="center")
+        self.history_tree.column("reason", width=120, anchor="center")
+        self.history_tree.column("title", width=280)
+        
+        history_scroll = ttk.Scrollbar(history_frame, orient=tk.VERTICAL, command=self.history_tree.yview)
+        self.history_tree.configure(yscrollcommand=history_scroll.set)
+        self.history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        history_scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        # 履歴操作
+        history_btn = ttk.Frame(history_tab)
+        history_btn.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(history_btn, text="🧹 クリア", command=self._clear_history).pack(side=tk.LEFT, padx=2)
+        ttk.Button(history_btn, text="🔁 失敗を再試行", command=self._retry_failed).pack(side=tk.LEFT, padx=2)
+        self.more_history_btn = ttk.Button(history_btn, text="⏬ さらに読み込む", command=self._load_more_history)
+        self.more_history_btn.pack(side=tk.LEFT, padx=2)
+        
+        # === ステータスバー ===
+        status_frame = ttk.Frame(main_frame)
+        status_frame.pack(fill=tk.X, pady=(8, 0))
+        
+        self.stats_var = tk.StringVar(value="")
+        ttk.Label(status_frame, textvariable=self.stats_var, relief=tk.SUNKEN, anchor=tk.E, padding="3"
+        ).pack(side=tk.RIGHT)
+        
+        self.status_var = tk.StringVar(value="準備完了")
+        ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W, padding="3"
+        ).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+    def _toggle_settings(self):
+        """設定パネルの表示切り替え"""
+        if self.settings_visible.get():
+            self.settings_frame.pack_forget()
+            self.settings_visible.set(False)
+        else:
+            self.settings_frame.pack(fill=tk.X, pady=(0, 8), after=self.root.winfo_children()[0].winfo_children()[0])
+            self.settings_visible.set(True)
+    
+    def _on_concurrency_changed(self, *args):
+        """同時DL数・ホスト毎上限・接続数の変更を実行中のバッチにも即座に反映する"""
+        try:
+            limit = max(1, min(self.concurrent_downloads.get(), MAX_CONCURRENT_DOWNLOADS))
+            per_host = max(0, min(self.per_host_limit.get(), MAX_CONCURRENT_DOWNLOADS))
+            fragments = max(1, min(self.concurrent_fragments.get(), MAX_CONCURRENT_FRAGMENTS))
+            budget = max(1, min(self.connection_budget.get(), MAX_CONNECTION_BUDGET))
+        except tk.TclError:
+            return
+        self.engine.set_concurrency(limit, per_host, fragments, budget)
+        self._save_settings({
+            "concurrent_downloads": limit,
+            "per_host_limit": per_host,
+            "concurrent_fragments": fragments,
+            "connection_budget": budget,
+        })
+    
+    def _on_bandwidth_limit_changed(self, *args):
+        try:
+            limit = max(0, min(self.bandwidth_limit.get(), MAX_BANDWIDTH_LIMIT))
+        except tk.TclError:
+            return
+        self.engine.set_bandwidth_limit(limit)
+        self._save_settings({"bandwidth_limit": limit})
+    
+    def _on_adaptive_changed(self):
+        adaptive = self.adaptive_concurrency.get()
+        self.engine.set_adaptive(adaptive)
+        self._save_settings({"adaptive_concurrency": adaptive})
+    
+    def _on_post_processing_changed(self, event):
+        labels = list(POST_PROCESSING_MODES.values())
+        self.engine.post_processing = list(POST_PROCESSING_MODES)[labels.index(self.post_processing_combo.get())]
+        self._save_settings({"post_processing": self.engine.post_processing})
+    
+    def _on_skip_existing_changed(self):
+        self.engine.skip_existing = self.skip_existing.get()
+        self._save_settings({"skip_existing": self.engine.skip_existing})
+    
+    def _on_cache_ttl_changed(self):
+        ttl = self.metadata_cache_ttl.get()
+        self.engine.metadata_cache.ttl_minutes = ttl
+        self._save_settings({"metadata_cache_ttl": ttl})
+    
+    def _on_url_focus_in(self, event):
+        if self.url_entry.get() == "URLを貼り付け...":
+            self.url_entry.delete(0, tk.END)
+    
+    def _on_url_focus_out(self, event):
+        if not self.url_entry.get():
+            self.url_entry.insert(0, "URLを貼り付け...")
+    
+    def _browse_folder(self):
+        folder = filedialog.askdirectory(initialdir=self.save_path.get())
+        if folder:
+            self.save_path.set(folder)
+            self._save_settings({"save_path": folder})
+    
+    def _browse_staging_dir(self):
+        folder = filedialog.askdirectory(initialdir=self.staging_dir.get() or self.save_path.get())
+        if folder:
+            self._set_staging_dir(folder)
+    
+    def _set_staging_dir(self, folder):
+        """作業フォルダを変更する（空で保存先に直接書く）。実行中のタスクは元のフォルダで仕上げる"""
+        self.staging_dir.set(folder)
+        self.engine.staging_dir = folder
+        self._save_settings({"staging_dir": folder})
+    
+    def _update_status(self, msg):
+        self.status_var.set(msg)
+    
+    def _update_tab_counts(self):
+        queue_count = len(self.queue_items)
+        history_count = len(self.history_tree.get_children())
+        self.notebook.tab(0, text=f"キュー ({queue_count})")
+        more = "+" if self.history_next_offset else ""
+        self.notebook.tab(1, text=f"履歴 ({history_count}{more})")
+    
+    def _add_to_queue(self):
+        url = self.url_entry.get().strip()
+        if not url or url == "URLを貼り付け...":
+            self._update_status("❌ URLを入力してください")
+            return
+        
+        added, duplicates, skipped = self.engine.enqueue([url])
+        if duplicates:
+            self._update_status("⚠ 既にキューに存在します")
+            return
+        if skipped:
+            self._update_status("⏭ 取得済みのためスキップしました")
+            return
+        self._update_status(f"📋 追加: {url[:40]}...")
+        
+        self.url_entry.delete(0, tk.END)
+        self.url_entry.insert(0, "URLを貼り付け...")
+    
+    def _open_bulk_import(self):
+        """複数URL・テキストファイル・クリップボードからの一括追加ダイアログ"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("一括追加")
+        dialog.geometry("600x400")
+        dialog.transient(self.root)
+        
+        frame = ttk.Frame(dialog, padding="10")
+        frame.pack(fill=tk.BOTH, expand=True)
+        ttk.Label(frame, text="URLを1行に1つずつ入力（#で始まる行は無視）").pack(anchor=tk.W)
+        
+        text = tk.Text(frame, height=15, wrap=tk.NONE, font=("", 10))
+        text.pack(fill=tk.BOTH, expand=True, pady=5)
+        
+        expand_playlists = tk.BooleanVar(value=self.settings.get("expand_playlists", True))
+        ttk.Checkbutton(frame, text="プレイリスト・チャンネルを動画ごとに展開", variable=expand_playlists
+        ).pack(anchor=tk.W)
+        
+        def paste_clipboard():
+            try:
+                text.insert(tk.END, self.root.clipboard_get().strip() + "\n")
+            except tk.TclError:
+                pass
+        
+        def start(lines=None, path=None):
+            self._save_settings({"expand_playlists": expand_playlists.get()})
+            self._start_ingest(lines=lines, path=path, expand=expand_playlists.get())
+            dialog.destroy()
+        
+        def load_file():
+            path = filedialog.askopenfilename(parent=dialog, filetypes=[("テキスト", "*.txt"), ("すべて", "*.*")])
+            if path:
+                start(path=path)
+        
+        btn_frame = ttk.Frame(frame)
+        btn_frame.pack(fill=tk.X, pady=(5, 0))
+        ttk.Button(btn_frame, text="📋 クリップボード", command=paste_clipboard).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btn_frame, text="📄 ファイルから...", command=load_file).pack(side=tk.LEFT, padx=2)
+        ttk.Button(btn_frame, text="追加", command=lambda: start(lines=text.get("1.0", tk.END).splitlines())
+        ).pack(side=tk.RIGHT, padx=2)
+    
+    def _start_ingest(self, lines=None, path=None, expand=False):
+        """取り込みスレッドを起動し、見つかったURLから順にキューへ流し込む"""
+        if self.ingest_running == 0:
+            self.ingest_stats = Counter()
+        self.ingest_running += 1
+        threading.Thread(target=self._ingest_worker, args=(lines, path, expand), daemon=True).start()
+        if self.ingest_job is None:
+            self.ingest_job = self.root.after(INGEST_INTERVAL_MS, self._ingest_tick)
+    
+    def _ingest_worker(self, lines, path, expand):
+        try:
+            if path is not None:
+                with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+                    self._ingest_lines(f, expand)
+            else:
+                self._ingest_lines(lines, expand)
+        except IOError:
+            self.ingest_inbox.put(("error", None))
+        finally:
+            self.ingest_inbox.put(("done", None))
+    
+    def _ingest_lines(self, lines, expand):
+        report = lambda kind: self.ingest_inbox.put((kind, None))
+        for url in iter_import_urls(lines, expand, report):
+            self.ingest_inbox.put(("url", url))
+    
+    def _ingest_tick(self):
+        """受け渡し口に溜まったURLを一定件数ずつキューへ追加する"""
+        self.ingest_job = None
+        batch = []
+        while len(batch) < INGEST_BATCH_SIZE:
+            try:
+                kind, url = self.ingest_inbox.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "url":
+                batch.append(url)
+            elif kind == "done":
+                self.ingest_running -= 1
+            else:
+                self.ingest_stats[kind] += 1
+        
+        if batch:
+            added, duplicates, skipped = self.engine.enqueue(batch)
+            self.ingest_stats["added"] += len(added)
+            self.ingest_stats["duplicate"] += duplicates
+            self.ingest_stats["skipped"] += skipped
+        
+        stats = self.ingest_stats
+        summary = (f"追加 {stats['added']}件 / 重複 {stats['duplicate']}件 / 取得済み {stats['skipped']}件"
+                   f" / 展開 {stats['playlist']}件 / 無効 {stats['invalid']}件 / エラー {stats['error']}件")
+        if self.ingest_running > 0 or not self.ingest_inbox.empty():
+            self._update_status(f"📥 取り込み中: {summary}")
+            self.ingest_job = self.root.after(INGEST_INTERVAL_MS, self._ingest_tick)
+        else:
+            self._update_status(f"📥 取り込み完了: {summary}")
+    
+    def _insert_queue_row(self, task, status="待機中"):
+        title = task.title if task.title else task.url
+        item = self.queue_tree.insert("", tk.END, values=(status, PRIORITY_LEVELS[task.priority], "0%", "", "",
+                                                          title[:60]))
+        self.queue_items[task.task_id] = item
+        self.queue_item_tasks[item] = task
+    
+    def _selected_task_ids(self):
+        return [self.queue_item_tasks[item].task_id for item in self.queue_tree.selection()
+                if item in self.queue_item_tasks]
+    
+    def _remove_from_queue(self):
+        # ダウンロード中・後処理中のタスクは中止され、履歴に移る
+        for task_id in self._selected_task_ids():
+            self.engine.cancel(task_id)
+    
+    def _pause_selected(self):
+        self.engine.pause(self._selected_task_ids())
+    
+    def _resume_selected(self):
+        self.engine.resume(self._selected_task_ids())
+    
+    def _move_selected(self, front):
+        self.engine.move(self._selected_task_ids(), front)
+    
+    def _on_priority_selected(self, event):
+        labels = list(PRIORITY_LEVELS.values())
+        priority = list(PRIORITY_LEVELS)[labels.index(self.priority_combo.get())]
+        self.engine.set_priority(self._selected_task_ids(), priority)
+    
+    def _clear_queue(self):
+        self.engine.clear_pending()
+    
+    def _clear_history(self):
+        self.history_tree.delete(*self.history_tree.get_children())
+        self.engine.clear_history()
+        self.history_next_offset = None
+        self.more_history_btn.config(state=tk.DISABLED)
+        self._update_tab_counts()
+    
+    def _retry_failed(self):
+        # 履歴ファイル全体を読むため、UIスレッドでは行わない（追加はエンジンの通知で反映される）
+        threading.Thread(target=self.engine.retry_failed, daemon=True).start()
+    
+    def _add_to_history(self, entry):
+        self.history_tree.insert("", 0, values=(entry["time"], entry["status"], entry["postprocess"],
+                                                ERROR_KINDS.get(entry.get("error_kind"), ""), entry["title"]))
+        self._update_tab_counts()
+    
+    def _set_downloading_state(self, is_downloading):
+        self.is_downloading = is_downloading
+        self.download_btn.config(state=tk.DISABLED if is_downloading else tk.NORMAL)
+        self.cancel_btn.config(state=tk.NORMAL if is_downloading else tk.DISABLED)
+        if is_downloading and self.ui_tick_job is None:
+            self._ui_tick()
+    
+    def _ui_tick(self):
+        """変化したタスクの行と全体進捗をまとめて反映する"""
+        if self.ui_tick_job is not None:
+            self.root.after_cancel(self.ui_tick_job)
+            self.ui_tick_job = None
+        for task_id, snapshot in self.engine.progress_board.drain().items():
+            self._update_queue_item(task_id, snapshot["status"], snapshot.get("progress"),
+                                    snapshot.get("speed"), snapshot.get("eta"))
+        
+        if self.is_downloading:
+            self._update_aggregate_stats()
+        
+        if self.is_downloading:
+            try:
+                refresh_hz = max(1, min(self.ui_refresh_hz.get(), MAX_UI_REFRESH_HZ))
+            except tk.TclError:
+                refresh_hz = DEFAULT_UI_REFRESH_HZ
+            self.ui_tick_job = self.root.after(1000 // refresh_hz, self._ui_tick)
+    
+    def _probe_loop_lag(self, expected=None):
+        """afterの呼び出しが予定よりどれだけ遅れたか（イベントループの詰まり）を計測値に記録する"""
+        now = time.monotonic()
+        if expected is not None:
+            self.engine.metrics.observe("ui_loop_lag", max(now - expected, 0.0))
+        self.root.after(LOOP_LAG_PROBE_MS, self._probe_loop_lag, now + LOOP_LAG_PROBE_MS / 1000)
+    
+    def _update_aggregate_stats(self):
+        """バイト数で重み付けした全体進捗と、合計速度・残り時間を表示する"""
+        stats = self.engine.stats()
+        self.progress_var.set(stats["overall"] * 100)
+        self.stats_var.set(format_stats(stats))
+    
+    def _cancel_all_downloads(self):
+        self.engine.cancel_all()
+    
+    def _update_queue_item(self, task_id, status=None, progress=None, speed=None, eta=None):
+        item = self.queue_items.get(task_id)
+        if item is None:
+            return
+        values = self.queue_tree.item(item, "values")
+        status = status if status is not None else values[0]
+        progress_str = f"{progress:.0f}%" if progress is not None else values[2]
+        speed_str = f"{format_bytes(speed)}/s" if speed else ""
+        eta_str = format_eta(eta) if speed else ""
+        task = self.queue_item_tasks[item]
+        title = task.title if task.title else task.url
+        self.queue_tree.item(item, values=(status, PRIORITY_LEVELS[task.priority], progress_str, speed_str, eta_str,
+                                           title[:60]))
+    
+    def _remove_queue_item(self, task_id):
+        item = self.queue_items.pop(task_id, None)
+        if item is None:
+            return
+        self.queue_item_tasks.pop(item, None)
+        self.queue_tree.delete(item)
+        self._update_tab_counts()
+    
+    def _start_queue_download(self):
+        if self.is_downloading:
+            return
+        if not self.engine.start(self.save_path.get()):
+            return
+        self.progress_var.set(0)
+        self._set_downloading_state(True)
+
+
+def main():
+    root = tk.Tk()
+    style = ttk.Style()
+    style.configure("Accent.TButton", font=("", 11, "bold"))
+    app = VideoDownloaderApp(root)
+    root.mainloop()
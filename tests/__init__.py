@@ -0,0 +1,20 @@
+"""
+単体テスト
+
+    python -m unittest discover
+
+downloader_engine は読み込み時に設定フォルダの場所を決めるため、
+各テストより先にここでHOMEを一時フォルダへ向ける（利用者の ~/.video_downloader に触れないように）
+"""
+
+import atexit
+import os
+import sys
+import shutil
+import tempfile
+
+TEST_HOME = tempfile.mkdtemp(prefix="video_downloader_test_")
+os.environ["HOME"] = TEST_HOME
+os.environ["USERPROFILE"] = TEST_HOME
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+atexit.register(shutil.rmtree, TEST_HOME, ignore_errors=True)
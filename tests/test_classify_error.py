@@ -0,0 +1,39 @@
+"""
+エラー分類の回帰テスト
+URLや動画IDに含まれる数字をHTTPのステータスと取り違えず、メッセージから原因を判別できることを確かめる
+
+    python -m unittest discover
+"""
+
+import unittest
+
+from downloader_engine import classify_error
+
+
+class ClassifyErrorTest(unittest.TestCase):
+    def test_throttled(self):
+        self.assertEqual(classify_error("ERROR: unable to download video data: HTTP Error 429: Too Many Requests"),
+                         "throttled")
+        self.assertEqual(classify_error("ERROR: [generic] Too Many Requests"), "throttled")
+    
+    def test_429_in_url_or_id(self):
+        self.assertEqual(classify_error("ERROR: Unsupported URL: https://example.com/video/84291"), "extractor")
+        self.assertEqual(classify_error("ERROR: [generic] id 4290: HTTP Error 404: Not Found"), "not_found")
+        self.assertEqual(classify_error("ERROR: https://example.com/429/clip: HTTP Error 403: Forbidden"), "forbidden")
+    
+    def test_http_status(self):
+        self.assertEqual(classify_error("HTTP Error 403: Forbidden"), "forbidden")
+        self.assertEqual(classify_error("HTTP Error 410: Gone"), "not_found")
+        self.assertEqual(classify_error("HTTP Error 503: Service Unavailable"), "timeout")
+        self.assertEqual(classify_error("HTTP Error 408: Request Timeout"), "timeout")
+    
+    def test_other_kinds(self):
+        self.assertEqual(classify_error("[Errno 28] No space left on device"), "disk_full")
+        self.assertEqual(classify_error("ffmpeg exited with code 1"), "ffmpeg")
+        self.assertEqual(classify_error("<urlopen error timed out>"), "timeout")
+        self.assertEqual(classify_error("ERROR: Private video"), "not_found")
+        self.assertEqual(classify_error("something unexpected"), "unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+空き容量待ちの回帰テスト
+空き容量が足りないタスクは容量待ちとして残し、常駐しないCLIで空きを作るタスクもない場合だけ失敗として終わることを確かめる
+後処理中に容量が尽きて容量待ちに戻ったタスクも、スケジューラが終了せずに取り出し直すことを確かめる
+
+    python -m unittest discover
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from downloader_engine import DownloadEngine
+
+from . import TEST_HOME
+
+
+class DiskSpaceTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(dir=TEST_HOME)
+        self.finished = []
+    
+    def _create_engine(self, settings):
+        engine = DownloadEngine(settings, journal_path=os.path.join(self.work_dir, "queue_journal.jsonl"))
+        engine.add_listener(lambda event, data: event == "task_finished" and self.finished.append(data["task"]))
+        engine.enqueue([f"https://example.com/disk/{self.id()}/{index}" for index in range(2)])
+        self.addCleanup(engine.close)
+        return engine
+    
+    def test_fails_when_nothing_can_free_space(self):
+        # どのディスクにも収まらない残し分を指定する
+        engine = self._create_engine({"min_free_space": 1 << 40})
+        self.assertTrue(engine.start(self.work_dir, fail_on_disk_shortfall=True))
+        self.assertTrue(engine.wait(10))
+        self.assertEqual([task.error_kind for task in self.finished], ["disk_full"] * 2)
+        self.assertFalse(engine.download_queue)
+    
+    def test_holds_for_space(self):
+        engine = self._create_engine({"min_free_space": 1 << 40})
+        self.assertTrue(engine.start(self.work_dir))
+        self.assertFalse(engine.wait(0.5))
+        self.assertEqual([task.disk_wait for task in engine.download_queue], [True, False])
+        self.assertEqual(self.finished, [])
+        engine.cancel_all()
+        self.assertTrue(engine.wait(10))
+    
+    def test_keep_alive_holds_until_idle(self):
+        engine = self._create_engine({"min_free_space": 1 << 40})
+        self.assertTrue(engine.start(self.work_dir, keep_alive=True, fail_on_disk_shortfall=True))
+        self.assertFalse(engine.wait(0.5))
+        self.assertEqual(self.finished, [])
+        engine.stop_when_idle()
+        self.assertTrue(engine.wait(10))
+        self.assertEqual([task.error_kind for task in self.finished], ["disk_full"] * 2)
+    
+    def test_notifies_without_queue_lock(self):
+        engine = self._create_engine({"min_free_space": 1 << 40})
+        blocked = []
+        
+        def on_event(event, data):
+            # GUIのように、通知の中で別のスレッドがエンジンの状態を読み終えるのを待つ
+            if event in ("status", "task_finished"):
+                reader = threading.Thread(target=engine.stats)
+                reader.start()
+                reader.join(2)
+                blocked.append(reader.is_alive())
+        
+        engine.add_listener(on_event)
+        self.assertTrue(engine.start(self.work_dir, keep_alive=True, fail_on_disk_shortfall=True))
+        self.assertFalse(engine.wait(0.5))
+        engine.stop_when_idle()
+        self.assertTrue(engine.wait(10))
+        self.assertEqual(len(self.finished), 2)
+        self.assertTrue(blocked)
+        self.assertFalse(any(blocked))
+    
+    def test_postprocess_disk_full_requeues(self):
+        engine = self._create_engine({"min_free_space": 0})
+        failures = [OSError(28, "No space left on device")]
+        
+        def run_postprocess(task, jobs):
+            # スケジューラがダウンロードの完了を見た後に、最初の1回だけ結合・移動中に容量が尽きたことにする
+            time.sleep(0.2)
+            if failures:
+                raise failures.pop()
+            return True
+        
+        engine._download_video = lambda task, save_dir: []
+        engine._run_postprocess = run_postprocess
+        self.assertTrue(engine.start(self.work_dir))
+        self.assertTrue(engine.wait(10))
+        self.assertEqual(sorted(task.error_kind for task in self.finished), ["", ""])
+        self.assertEqual([task.attempts for task in self.finished if task.resumed], [1])
+        self.assertFalse(engine.download_queue)
+
+
+if __name__ == "__main__":
+    unittest.main()
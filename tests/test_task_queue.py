@@ -0,0 +1,68 @@
+"""
+待機キューの並べ替え・一時停止の回帰テスト
+同じ優先度・順番で入れ直したタスクが、ヒープに残った無効な項目と比べられても壊れないことを確かめる
+
+    python -m unittest discover
+"""
+
+import os
+import tempfile
+import unittest
+
+from downloader_engine import DEFAULT_PRIORITY, DownloadEngine, DownloadTask, TaskQueue
+
+from . import TEST_HOME
+
+
+class TaskQueueTest(unittest.TestCase):
+    def test_reprioritize_same_priority(self):
+        queue = TaskQueue()
+        tasks = [DownloadTask(f"https://example.com/{index}", index) for index in range(1, 4)]
+        for task in tasks:
+            queue.push(task)
+        queue.reprioritize(tasks[0], DEFAULT_PRIORITY)
+        self.assertEqual([queue.pop_next(lambda host: True) for _ in tasks], tasks)
+        self.assertIsNone(queue.pop_next(lambda host: True))
+    
+    def test_remove_and_restore_head(self):
+        queue = TaskQueue()
+        tasks = [DownloadTask(f"https://example.com/{index}", index) for index in range(1, 4)]
+        for task in tasks:
+            queue.push(task)
+        queue.remove(tasks[0])
+        queue.restore(tasks[0])
+        self.assertEqual(queue.ordered(), tasks)
+        self.assertEqual([queue.pop_next(lambda host: True) for _ in tasks], tasks)
+
+
+class EngineQueueTest(unittest.TestCase):
+    def setUp(self):
+        work_dir = tempfile.mkdtemp(dir=TEST_HOME)
+        self.engine = DownloadEngine({}, journal_path=os.path.join(work_dir, "queue_journal.jsonl"))
+        self.tasks, _, _ = self.engine.enqueue([f"https://example.com/{index}" for index in range(3)])
+    
+    def tearDown(self):
+        self.engine.close()
+    
+    def test_pause_resume_pending_head(self):
+        task_id = self.tasks[0].task_id
+        self.engine.pause([task_id])
+        self.engine.resume([task_id])
+        self.assertEqual([state for state, _ in self.engine.list_tasks()], ["pending"] * 3)
+        self.assertEqual(list(self.engine.download_queue), self.tasks)
+    
+    def test_set_priority_unchanged(self):
+        self.engine.set_priority([self.tasks[0].task_id], DEFAULT_PRIORITY)
+        self.assertEqual(list(self.engine.download_queue), self.tasks)
+    
+    def test_remove_releases_output_name(self):
+        save_dir = tempfile.mkdtemp(dir=TEST_HOME)
+        base = os.path.join(save_dir, "clip")
+        self.assertEqual(self.engine._claim_output_name(self.tasks[0], base, save_dir), base)
+        self.assertEqual(self.engine._claim_output_name(self.tasks[1], base, save_dir), f"{base} (2)")
+        self.engine.remove([self.tasks[0].task_id])
+        self.assertEqual(self.engine._claim_output_name(self.tasks[2], base, save_dir), base)
+
+
+if __name__ == "__main__":
+    unittest.main()